@@ -2,6 +2,9 @@ import re
 from antlr4 import *
 from colorama import Fore, init
 
+# the table backed helpers import symbol_table (scripts/) when they are called, so extractor.py, which only needs
+# extract_state_variables_from_code, still runs from certora_projects/ without it on the path
+
 
 def extract_solc_version(filename):
     with open(filename, 'r') as file:
@@ -65,17 +68,8 @@ def extract_comments_from_contract(file_path, contract_name):
     return comments
 
 def extract_state_variables(contract_name, solidity_file_path):
-    with open(solidity_file_path, 'r') as file:
-        solidity_code = file.read()
-    # # Find the contract
-    # contract_pattern = re.compile(f'contract\\s+{contract_name}\\s*{{(.+?)}}', re.DOTALL)
-    # match = contract_pattern.search(solidity_code)
-
-    # if match is None:
-    #     raise ValueError(f"No contract found with name: {contract_name}")
-
-    # contract_body = match.group(1)
-    contract_body = extract_contract(contract_name, solidity_code)
+    from symbol_table import load_symbol_table
+    contract_body = extract_contract_from_table(contract_name, load_symbol_table(solidity_file_path))
     # state_variable_pattern = re.compile(r'(public|private|internal|external)?\s+(uint256|uint|bool|string|address)\s+\w+;')
     state_variable_pattern = re.compile(
         r'[public|private|internal|external]?\s+\w+;')
@@ -99,67 +93,33 @@ def extract_modifier_names_of_a_function(function_code):
 
 
 def extract_modifier_names(solidity_file_path, contract_name=None):
-    with open(solidity_file_path, 'r') as file:
-        solidity_code = file.read()
-    # Find the contract
-    # contract_pattern = re.compile(f'contract\\s+{contract_name}\\s*{{(.+?)}}', re.DOTALL)
-    # match = contract_pattern.search(solidity_code)
-
-    # if match is None:
-    #     raise ValueError(f"No contract found with name: {contract_name}")
-
-    # contract_body = match.group(1)
-    if contract_name:
-        contract_body = extract_contract(contract_name, solidity_code)
-    else:
-        contract_body = solidity_code
-    modifier_pattern = re.compile(r'modifier\s+(\w+)', re.DOTALL)
-
-    modifiers = modifier_pattern.findall(contract_body)
-    if modifiers:
-        return [each.replace('modifier ', '') for each in modifiers]
-    else:
-        return []
+    from symbol_table import load_symbol_table
+    table = load_symbol_table(solidity_file_path)
+    return [entry['name'] for entry in table_modifiers(table, contract_name)]
 
 
 def extract_modifiers(solidity_file_path, contract_name=None):
-    with open(solidity_file_path, 'r') as file:
-        solidity_code = file.read()
-    # Find the contract
-    # contract_pattern = re.compile(f'contract\\s+{contract_name}\\s*{{(.+?)}}', re.DOTALL)
-    # match = contract_pattern.search(solidity_code)
-
-    # if match is None:
-    #     raise ValueError(f"No contract found with name: {contract_name}")
-
-    # contract_body = match.group(1)
-    if contract_name:
-        contract_body = extract_contract(contract_name, solidity_code)
-    else:
-        contract_body = solidity_code
-    modifier_pattern = re.compile(r'modifier\s+\w+\s*\((.*?)\)\s*{(.*?)}', re.DOTALL)
-
-    modifiers = modifier_pattern.findall(contract_body)
+    from symbol_table import load_symbol_table
+    table = load_symbol_table(solidity_file_path)
+    modifiers = []
+    for entry in table_modifiers(table, contract_name):
+        header_end = entry['body_start'] if entry['body_start'] is not None else entry['end']
+        params = re.search(r'\((.*?)\)', table.code[entry['start']:header_end], re.DOTALL)
+        modifiers.append((params.group(1) if params else '', table.body(entry)))
 
     return modifiers
 
-def extract_inherited_contracts(contract_name, solidity_file_path):
-    with open(solidity_file_path, 'r') as file:
-        solidity_code = file.read()
-    inherited_contracts = []
-
-    # Pattern to match 'contract A is B, C, D { ... }'
-    inheritance_pattern = re.compile(f'contract\\s+{contract_name}\\s+is\\s+([\\w\\s,]+)\\s*{{')
-
-    # Find all inherited contracts
-    match = inheritance_pattern.search(solidity_code)
-
-    if match:
-        # If there are inherited contracts, they are separated by commas
-        # Split the string by comma and strip leading/trailing white space to get contract names
-        inherited_contracts = [name.strip() for name in match.group(1).split(',')]
+# modifiers of one contract in file order, the whole file if the contract is not declared in it
+def table_modifiers(table, contract_name=None):
+    if contract_name not in table.contracts:
+        contract_name = None
+    return sorted(table.modifiers_of(contract_name), key=lambda entry: entry['start'])
 
-    return inherited_contracts
+def extract_inherited_contracts(contract_name, solidity_file_path):
+    from symbol_table import load_symbol_table
+    contract = load_symbol_table(solidity_file_path).contracts.get(contract_name)
+    # 'contract A is B, C, D { ... }' -> [B, C, D]
+    return list(contract['bases']) if contract else []
 
 def extract_imported_contracts(solidity_file_path):
     with open(solidity_file_path, 'r') as file:
@@ -203,42 +163,21 @@ def extract_contract(contract_name, solidity_code):
     contract_body = solidity_code[start:end + 1]
     return contract_body
 
-def extract_function_from_solidity(function_name, solidity_file_path):
-    # Read the Solidity code from the file
-    func_or_modi = 'function'
-    with open(solidity_file_path, 'r') as file:
-        contract_body = file.read()
-        # Find the function
-        if function_name == 'constructor':
-            # If the function is a constructor
-            function_pattern = re.compile(f'{function_name}\\s*\\((.*?)\\)', re.DOTALL)
-            match = function_pattern.search(contract_body)
-        else:
-            function_pattern = re.compile(f'function\\s+{function_name}\\s*\\((.*?)\\)', re.DOTALL)
-
-            match = function_pattern.search(contract_body)
-        if match is None:
-            raise ValueError(f"No function found with name: {function_name} in contract: {contract_name}")
-        start = match.start()
-        open_braces = 0
-
-        first_bracket = False
-
-        # Go through the contract body from the start of the function until we've closed all braces
-        for end in range(start, len(contract_body)):
-            if contract_body[end] == '{':
-                open_braces += 1
-                first_bracket = True
-            elif contract_body[end] == '}':
-                open_braces -= 1
-
-            # If all braces are closed, we've found the end of the function
-            if open_braces == 0 and first_bracket:
-                break
+# the contract body from '{' to '}' out of an already indexed file, same as extract_contract()
+def extract_contract_from_table(contract_name, table):
+    contract = table.contracts.get(contract_name)
+    if contract is None:
+        return table.code
+    return table.code[contract['body_start']:contract['end'] + 1]
 
-        function_body = contract_body[start:end + 1]
+def extract_function_from_solidity(function_name, solidity_file_path):
+    from symbol_table import load_symbol_table
+    table = load_symbol_table(solidity_file_path)
+    function = table.find_function(function_name)
+    if function is None:
+        raise ValueError(f"No function found with name: {function_name} in file: {solidity_file_path}")
 
-        return function_body
+    return table.source(function)
 
 def extract_contract_with_name(contract_name,solidity_code):
    
@@ -248,56 +187,28 @@ def extract_contract_with_name(contract_name,solidity_code):
         contract_body = solidity_code
     return contract_body
 def extract_function_with_contract(contract_name, function_name, solidity_file_path):
-    # Read the Solidity code from the file
+    from symbol_table import load_symbol_table
     func_or_modi = 'function'
     if solidity_file_path == "":
         print(Fore.RED +"No solidity file path")
         init(autoreset=True)
         return None, None
-    
-    with open(solidity_file_path, 'r') as file:
-        solidity_code = file.read()
-        if contract_name!="":
-            contract_body = extract_contract(contract_name, solidity_code)
-        else:
-            contract_body = solidity_code
-        # Find the function
-        if function_name == contract_name or function_name == 'constructor':
-            # If the function is a constructor
-            function_pattern = re.compile(f'{function_name}\\s*\\((.*?)\\)', re.DOTALL)
-            match = function_pattern.search(contract_body)
-        else:
-            function_pattern = re.compile(f'function\\s+{function_name}\\s*\\((.*?)\\)', re.DOTALL)
-
-            match = function_pattern.search(contract_body)
-            if match is None:
-                function_pattern = re.compile(f'modifier\\s+{function_name}\\s*\\((.*?)\\)', re.DOTALL)
 
-                match = function_pattern.search(contract_body)
-                if match:
-                    func_or_modi = 'modifier'
-        if match is None:
-            raise ValueError(f"No function found with name: {function_name} in contract: {contract_name}")
-        start = match.start()
-        open_braces = 0
-
-        first_bracket = False
-
-        # Go through the contract body from the start of the function until we've closed all braces
-        for end in range(start, len(contract_body)):
-            if contract_body[end] == '{':
-                open_braces += 1
-                first_bracket = True
-            elif contract_body[end] == '}':
-                open_braces -= 1
-
-            # If all braces are closed, we've found the end of the function
-            if open_braces == 0 and first_bracket:
-                break
-
-        function_body = contract_body[start:end + 1]
-
-        return function_body, func_or_modi
+    table = load_symbol_table(solidity_file_path)
+    contract = contract_name if contract_name in table.contracts else None  # unknown contract, search the whole file
+    if function_name == contract_name or function_name == 'constructor':
+        # If the function is a constructor
+        function = table.find_function('constructor', contract) or table.find_function(function_name, contract)
+    else:
+        function = table.find_function(function_name, contract)
+        if function is None:
+            function = table.find_modifier(function_name, contract)
+            if function:
+                func_or_modi = 'modifier'
+    if function is None:
+        raise ValueError(f"No function found with name: {function_name} in contract: {contract_name}")
+
+    return table.source(function), func_or_modi
 
 
 # use the function like this
@@ -228,40 +228,51 @@ def format_and_write_to_csv(code_blocks):
             ])
 
 #this function makes the content of each block to be self-contained, expaned it to include all non-duplicate lines of code of functions it is calling, this helps in better analysis of function
+#block names are matched once per line as whole identifiers into a reference graph, and each block's expansion is memoized so shared references are only expanded once
 def update_blocks_with_cross_references(code_blocks):
-    def find_block_by_name(name):
-        for block in code_blocks:
-            if block['block_name'] == name:
-                return block
-        return None
+    index_by_name = {}
+    for i, block in enumerate(code_blocks):
+        index_by_name.setdefault(block['block_name'], i)  # first block wins for duplicate names
 
-    def update_block_content(block, visited=None):
-        if visited is None:
-            visited = set()
-
-        if block['block_name'] in visited:
-            return []
-
-        visited.add(block['block_name'])
-        updated_content = []
-
-        for line in block['block_content']:
-            if line not in updated_content:
-                updated_content.append(line)  # avoids duplicate lines
-
-            for other_block in code_blocks:
-                if other_block['block_name'] in line and other_block['block_name'] != block['block_name']:
-                    referenced_block = find_block_by_name(other_block['block_name']) #add lines of referenced function, would add it to the content of current function under analysis
-                    if referenced_block:
-                        ref_block_content = update_block_content(referenced_block, visited)
-                        for ref_line in ref_block_content:
-                            if ref_line not in updated_content:
-                                updated_content.append(ref_line)  # adds new content from referenced blocks, avoiding duplicates
-
-        return updated_content
+    contents = [block['block_content'] for block in code_blocks]  # original content, blocks get replaced below
 
+    # for every line of every block, the blocks it references, kept in block order
+    references = []
     for block in code_blocks:
-        block['block_content'] = update_block_content(block)
+        own_index = index_by_name[block['block_name']]
+        line_refs = []
+        for line in block['block_content']:
+            refs = {index_by_name[name] for name in re.findall(r"[A-Za-z_$][\w$]*", line) if name in index_by_name}
+            refs.discard(own_index)
+            line_refs.append(sorted(refs))
+        references.append(line_refs)
+
+    expanded = {}  # only blocks whose expansion did not hit a reference cycle are memoized
+
+    def update_block_content(i, in_progress):
+        if i in expanded:
+            return expanded[i], True
+
+        in_progress.add(i)  # blocks currently being expanded, breaks reference cycles
+        updated_content = {}  # ordered set of lines, avoids duplicate lines
+        complete = True
+        for line, refs in zip(contents[i], references[i]):
+            updated_content.setdefault(line)
+            for ref in refs:
+                if ref in in_progress:
+                    complete = False
+                    continue
+                ref_content, ref_complete = update_block_content(ref, in_progress)
+                updated_content.update(dict.fromkeys(ref_content))  # adds new content from referenced blocks
+                complete = complete and ref_complete
+        in_progress.discard(i)
+
+        if complete:
+            expanded[i] = tuple(updated_content)
+        return tuple(updated_content), complete
+
+    for i, block in enumerate(code_blocks):
+        block['block_content'] = list(update_block_content(i, set())[0])
         block['methods_in_block'] = find_methods_in_block_from_content(block['block_content'])
 
 #capture function calls, exclude require/assert
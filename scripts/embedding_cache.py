@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import hashlib
+from contextlib import contextmanager
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: #windows, no locking between processes there
+    fcntl = None
+
+PATH_TO_EMBEDDING_CACHE = os.path.join(os.getcwd(), 'DataIndex', 'embedding_cache')
+EMBEDDING_DIM = 768 #codebert hidden size
+MAX_ENTRIES = 50000 #~150MB of float32 vectors at 768 dims
+
+#a vector depends on the model, how it was pooled and the cleaned text it was computed from, nothing else
+def cache_key(model_name, pooling, cleaned_text):
+    return hashlib.sha256(f"{model_name}\0{pooling}\0{cleaned_text}".encode('utf-8')).hexdigest()
+
+#embedding cache shared by vectorizer, rag_agent and rag_server. vectors live in a memory mapped float32 file with one row per slot,
+#a small json index maps key -> slot in least recently used first order. when full, the least recently used slot is reused.
+#several processes can use the same cache: writes take an exclusive flock on index.lock, reload whatever index is on disk,
+#write their rows and replace the index before letting go; reads take a shared lock and reload the index if someone replaced it
+class EmbeddingCache:
+    def __init__(self, path=PATH_TO_EMBEDDING_CACHE, dim=EMBEDDING_DIM, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.dim = dim
+        self.max_entries = max_entries
+        self.index_path = os.path.join(path, 'index.json')
+        self.vectors_path = os.path.join(path, 'vectors.f32')
+        self.lock_path = os.path.join(path, 'index.lock')
+        self.slots = OrderedDict() #key -> slot, oldest use first
+        self.free_slots = []
+        self.touched = {} #keys hit since the last save, moved to the back again when the index is reloaded
+        self.index_stamp = None
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+
+        os.makedirs(path, exist_ok=True)
+        with self._locked(exclusive=True):
+            self._load_index()
+            self.vectors = self._open_vectors()
+
+    @contextmanager
+    def _locked(self, exclusive):
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    #os.replace gives the index a new inode, so this changes whenever another process saved
+    def _stamp(self):
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _load_index(self):
+        self.slots = OrderedDict()
+        self.index_stamp = self._stamp()
+        if self.index_stamp is None:
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"ignoring unreadable embedding cache index at {self.index_path}; {e}", file=sys.stderr)
+            return
+        if index.get('dim') != self.dim or index.get('max_entries') != self.max_entries: #different model or size, start over
+            return
+        self.slots = OrderedDict((key, slot) for key, slot in index.get('slots', []))
+
+    def _find_free_slots(self):
+        used = set(self.slots.values())
+        self.free_slots = [slot for slot in range(self.max_entries-1, -1, -1) if slot not in used]
+
+    def _open_vectors(self):
+        expected_size = self.max_entries * self.dim * 4
+        if not os.path.exists(self.vectors_path) or os.path.getsize(self.vectors_path) != expected_size:
+            self.slots.clear()
+            vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='w+', shape=(self.max_entries, self.dim))
+        else:
+            vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(self.max_entries, self.dim))
+        self._find_free_slots()
+        return vectors
+
+    #pick up another process's index, keeping our own recent hits at the back. only called under the lock
+    def _refresh(self):
+        if self._stamp() == self.index_stamp:
+            return
+        self._load_index()
+        for key in self.touched:
+            if key in self.slots:
+                self.slots.move_to_end(key)
+        self._find_free_slots()
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    #vectors for keys in order, None where missing. rows are copied under the lock so nobody overwrites them halfway
+    def get_many(self, keys):
+        vectors = []
+        with self._locked(exclusive=False):
+            self._refresh()
+            for key in keys:
+                slot = self.slots.get(key)
+                if slot is None:
+                    self.misses += 1
+                    vectors.append(None)
+                    continue
+                self.hits += 1
+                self.slots.move_to_end(key)
+                self.touched[key] = True
+                self.dirty = True
+                vectors.append(np.array(self.vectors[slot]))
+        return vectors
+
+    #make sure count slots are free. evicted keys leave the index on disk before their rows get overwritten,
+    #so a crash in between never leaves a key pointing at another text's vector
+    def _reserve(self, count):
+        if len(self.free_slots) >= count or not self.slots:
+            return
+        while len(self.free_slots) < count and self.slots:
+            key, slot = self.slots.popitem(last=False) #least recently used first
+            self.touched.pop(key, None)
+            self.free_slots.append(slot)
+        self._write_index()
+
+    def put(self, key, vector):
+        self.put_many([key], [vector])
+
+    #reserve, write and save in one go under the lock, the index on disk never points at a row another process is writing
+    #a batch with more keys than the cache holds keeps its last max_entries keys, the earlier ones would be evicted by them anyway
+    def put_many(self, keys, vectors):
+        latest = {}
+        for key, vector in zip(keys, vectors): #repeated keys keep their last vector and position
+            latest.pop(key, None)
+            latest[key] = vector
+        items = list(latest.items())[-self.max_entries:]
+        with self._locked(exclusive=True):
+            self._refresh()
+            for key, _ in items: #keys of the batch that are already cached are not the ones to evict
+                if key in self.slots:
+                    self.slots.move_to_end(key)
+            self._reserve(len({key for key, _ in items if key not in self.slots}))
+            for key, vector in items:
+                slot = self.slots.get(key)
+                if slot is None:
+                    slot = self.free_slots.pop()
+                self.slots[key] = slot
+                self.slots.move_to_end(key)
+                self.vectors[slot] = np.asarray(vector, dtype=np.float32)
+            self._write_index()
+
+    def _write_index(self):
+        self.vectors.flush()
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'dim': self.dim, 'max_entries': self.max_entries, 'slots': list(self.slots.items())}, f, separators=(',', ':'))
+        os.replace(tmp_path, self.index_path) #index only points at rows that were flushed before it
+        self.index_stamp = self._stamp()
+        self.touched.clear()
+        self.dirty = False
+
+    #only the use order is left to save, puts write the index themselves
+    def save(self):
+        if not self.dirty:
+            return
+        with self._locked(exclusive=True):
+            self._refresh()
+            self._write_index()
+
+    def stats(self):
+        return f"embedding cache: {self.hits} hits, {self.misses} misses, {len(self.slots)}/{self.max_entries} entries"
@@ -0,0 +1,269 @@
+#codebert encoder shared by vectorizer and rag_agent: model loading for every backend, batching and windowed cls embedding
+#torch and transformers are imported by the functions that need them, so rag_agent can read the constants and cache keys
+#on its fast path without paying seconds of imports
+
+import os
+import sys
+import shutil
+import time
+import types
+
+import numpy as np
+
+from embedding_cache import cache_key
+
+MODEL_NAME = "microsoft/codebert-base"
+BACKENDS = ("fp32", "int8", "onnx")
+DEFAULT_BACKEND = os.environ.get("SCRIA_ENCODER", "fp32") #rag_agent is started by app.js without flags, the env var picks its backend
+PATH_TO_ONNX_MODEL = os.path.join(os.getcwd(), 'DataIndex', 'onnx', 'codebert-base.onnx')
+PATH_TO_MODEL_BUNDLE = os.path.join(os.getcwd(), 'DataIndex', 'models', 'codebert-base') #local safetensors copy, see --export-bundle
+POOLING = "cls-window-mean" #cls vector of every window, averaged for the whole text
+WINDOW_POOLING = "cls-window" #cache entries of single windows, keyed by their token ids
+BATCH_SIZE = 32 #fixed batch size, only used with --fixed-batches
+MAX_LENGTH = 512
+TOKENS_PER_BATCH = 8192 #padded tokens per forward pass, batch size * longest member in the batch
+WINDOW_STRIDE = 128 #tokens shared by consecutive windows of a text longer than MAX_LENGTH
+
+#where from_pretrained loads from. with a bundle on disk there is no hub lookup at all (no cache resolution, no network),
+#and its tokenizer.json loads the fast tokenizer directly instead of converting vocab.json/merges.txt on every start
+def model_source():
+    if os.path.exists(os.path.join(PATH_TO_MODEL_BUNDLE, 'config.json')):
+        return PATH_TO_MODEL_BUNDLE, {"local_files_only": True}
+    return MODEL_NAME, {}
+
+#same weights as the hub model, so vectors and cache keys do not change
+def export_bundle(path=PATH_TO_MODEL_BUNDLE):
+    from transformers import AutoTokenizer, AutoModel
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    model = AutoModel.from_pretrained(MODEL_NAME)
+    shutil.rmtree(path + ".tmp", ignore_errors=True)
+    tokenizer.save_pretrained(path + ".tmp")
+    model.save_pretrained(path + ".tmp", safe_serialization=True)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(path + ".tmp", path)
+    print(f"saved {MODEL_NAME} to {path}", file=sys.stderr)
+
+def export_onnx(path=PATH_TO_ONNX_MODEL):
+    import torch
+    from transformers import AutoModel
+
+    #only the hidden states, so the exported onnx graph has a single plain output
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+    source, options = model_source()
+    model = AutoModel.from_pretrained(source, **options)
+    model.eval()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    dummy = torch.ones((1, 8), dtype=torch.long)
+    dynamic = {0: "batch", 1: "sequence"}
+    torch.onnx.export(
+        LastHiddenState(model),
+        (dummy, dummy),
+        path + ".tmp",
+        input_names=["input_ids", "attention_mask"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={"input_ids": dynamic, "attention_mask": dynamic, "last_hidden_state": dynamic},
+        opset_version=14
+    )
+    os.replace(path + ".tmp", path)
+    print(f"exported {MODEL_NAME} to {path}", file=sys.stderr)
+
+#onnxruntime session behind the same call signature as the torch model, embed_texts does not know the difference
+class OnnxModel:
+    def __init__(self, path=PATH_TO_ONNX_MODEL):
+        import torch
+        try:
+            import onnxruntime
+        except ImportError:
+            print("the onnx backend needs onnxruntime and onnx: pip install onnxruntime onnx", file=sys.stderr)
+            sys.exit(1)
+        if not os.path.exists(path):
+            export_onnx(path)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, input_ids, attention_mask):
+        import torch
+        hidden = self.session.run(["last_hidden_state"], {"input_ids": input_ids.cpu().numpy(), "attention_mask": attention_mask.cpu().numpy()})[0]
+        return types.SimpleNamespace(last_hidden_state=torch.from_numpy(hidden))
+
+#tokenizer, model and device for a backend. fp32 is the plain model (cuda if there is one), int8 quantizes every linear layer
+#dynamically and onnx runs an exported graph with onnxruntime, both cpu only
+def load_encoder(backend=DEFAULT_BACKEND):
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown encoder backend {backend}, expected one of {', '.join(BACKENDS)}")
+    import torch
+    from transformers import AutoTokenizer, AutoModel
+
+    source, options = model_source()
+    tokenizer = AutoTokenizer.from_pretrained(source, **options)
+
+    if backend == "onnx":
+        model = OnnxModel()
+        device = torch.device("cpu")
+    elif backend == "int8":
+        device = torch.device("cpu")
+        model = AutoModel.from_pretrained(source, **options)
+        model.eval()
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    else:
+        device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+        model = AutoModel.from_pretrained(source, **options).to(device)
+        model.eval()
+
+    model.encoder_id = backend_id(backend)
+    return tokenizer, model, device
+
+#name of a backend in cache keys, vectors of different backends never share cache entries. known without loading anything
+def backend_id(backend=DEFAULT_BACKEND):
+    return MODEL_NAME if backend == "fp32" else f"{MODEL_NAME}@{backend}"
+
+def encoder_id(model):
+    return getattr(model, "encoder_id", MODEL_NAME)
+
+#records/tokens embedded and time spent in the model, padded tokens show how much of that time went to padding
+class Throughput:
+    def __init__(self):
+        self.records = 0
+        self.tokens = 0
+        self.padded_tokens = 0
+        self.seconds = 0.0
+
+    def report(self, label="vectorizer"):
+        seconds = max(self.seconds, 1e-9)
+        padding = 100.0 * (self.padded_tokens - self.tokens) / self.padded_tokens if self.padded_tokens else 0.0
+        print(f"{label}: {self.records} records, {self.tokens} tokens in {self.seconds:.2f}s ({self.tokens/seconds:.0f} tokens/s, {self.records/seconds:.1f} records/s, {padding:.1f}% padding)")
+
+#batches as lists of indices into lengths. bucketed: sorted by length and packed while batch size * longest stays within tokens_per_batch,
+#otherwise fixed BATCH_SIZE slices in the given order (the old behaviour, kept to compare against)
+def plan_batches(lengths, tokens_per_batch=TOKENS_PER_BATCH, bucketed=True):
+    if not bucketed:
+        return [list(range(i, min(i+BATCH_SIZE, len(lengths)))) for i in range(0, len(lengths), BATCH_SIZE)]
+
+    batches = []
+    batch = []
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        if batch and (len(batch)+1) * lengths[i] > tokens_per_batch: #ascending order, so lengths[i] is the longest of the batch
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+#windows of at most MAX_LENGTH tokens, consecutive windows of a long text share WINDOW_STRIDE tokens
+def tokenize_windows(tokenizer, texts):
+    return tokenizer(texts, truncation=True, max_length=MAX_LENGTH, stride=WINDOW_STRIDE, return_overflowing_tokens=True)
+
+#texts longer than MAX_LENGTH are split into overlapping windows instead of being truncated. every window of every text goes through
+#the model in the same length bucketed batches, so cost follows the total token count. returns (one pooled vector per text, window vectors per text)
+#in the order of texts. with a cache, windows it already has (same token ids) are not run again
+#texts may already be tokenized with tokenize_windows (the vectorizer does it on other threads)
+def embed_texts(tokenizer, model, device, texts, tokens_per_batch=TOKENS_PER_BATCH, bucketed=True, throughput=None, cache=None, encodings=None):
+    import torch
+    if encodings is None:
+        encodings = tokenize_windows(tokenizer, texts)
+    owners = encodings['overflow_to_sample_mapping'] #window -> index of its text
+    windows = encodings['input_ids']
+    window_vectors = [None] * len(windows)
+
+    keys = None
+    if cache is not None:
+        keys = [cache_key(encoder_id(model), WINDOW_POOLING, " ".join(map(str, input_ids))) for input_ids in windows]
+        window_vectors = [None if vector is None else vector.tolist() for vector in cache.get_many(keys)]
+    missing = [w for w, vector in enumerate(window_vectors) if vector is None]
+    lengths = [len(windows[w]) for w in missing]
+
+    for batch in plan_batches(lengths, tokens_per_batch, bucketed):
+        batch_windows = [missing[b] for b in batch]
+        inputs = tokenizer.pad(
+            {key: [encodings[key][w] for w in batch_windows] for key in ('input_ids', 'attention_mask')},
+            return_tensors="pt"
+        ).to(device)
+
+        started = time.perf_counter()
+        with torch.no_grad():
+            outputs = model(**inputs)
+            vectors = outputs.last_hidden_state[:, 0, :].cpu().tolist()
+        if throughput is not None:
+            throughput.seconds += time.perf_counter() - started
+            throughput.tokens += sum(lengths[b] for b in batch)
+            throughput.padded_tokens += inputs['input_ids'].numel()
+
+        for w, vector in zip(batch_windows, vectors):
+            window_vectors[w] = vector
+    if cache is not None and missing:
+        cache.put_many([keys[w] for w in missing], [window_vectors[w] for w in missing])
+    if throughput is not None:
+        throughput.records += len(texts)
+
+    grouped = [[] for _ in texts]
+    for w, owner in enumerate(owners):
+        grouped[owner].append(window_vectors[w])
+    pooled = [np.mean(np.asarray(vectors, dtype=np.float32), axis=0).tolist() if len(vectors) > 1 else vectors[0] for vectors in grouped]
+    return pooled, grouped
+
+def cosine_rows(a, b):
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    return (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) + 1e-12)
+
+#embeds a sample of the master index with fp32 and every other backend. reports speed, cosine against fp32 and recall@k of the
+#neighbours each backend finds in the existing collection, with the fp32 neighbours as ground truth
+def parity_check(backends, sample_size=200, k=5):
+    from master_index import MasterIndex, PATH_TO_MASTER_INDEX
+    from vectorizer import is_indexable, clean_code
+    from vector_store import open_store, KNOWLEDGE_BASE
+
+    texts = []
+    with MasterIndex(PATH_TO_MASTER_INDEX) as data:
+        for record in data.records(is_indexable):
+            texts.append(clean_code(record['text_chunk']))
+            if len(texts) >= sample_size:
+                break
+    collection = open_store(KNOWLEDGE_BASE)
+
+    results = {}
+    for backend in ("fp32",) + tuple(backend for backend in backends if backend != "fp32"):
+        tokenizer, model, device = load_encoder(backend)
+        throughput = Throughput()
+        vectors, _ = embed_texts(tokenizer, model, device, texts, throughput=throughput)
+        neighbours = collection.query(vectors, n_results=k, include=())['ids']
+        results[backend] = (vectors, neighbours, throughput)
+        del model
+
+    reference_vectors, reference_neighbours, reference_throughput = results["fp32"]
+    print(f"parity over {len(texts)} records, recall@{k} against the fp32 neighbours in the collection")
+    print("backend  records/s  speedup  cosine(mean)  cosine(min)  recall@k")
+    for backend, (vectors, neighbours, throughput) in results.items():
+        cosines = cosine_rows(reference_vectors, vectors)
+        recall = np.mean([len(set(found) & set(expected)) / max(len(set(expected)), 1) for found, expected in zip(neighbours, reference_neighbours)])
+        rate = throughput.records / max(throughput.seconds, 1e-9)
+        reference_rate = reference_throughput.records / max(reference_throughput.seconds, 1e-9)
+        print(f"{backend:<7}  {rate:>9.1f}  {rate/reference_rate:>6.2f}x  {cosines.mean():>12.4f}  {cosines.min():>11.4f}  {recall:>8.3f}")
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="codebert encoder backends")
+    arg_parser.add_argument("--export-bundle", action="store_true", help=f"save the model and tokenizer to {PATH_TO_MODEL_BUNDLE}, later loads skip the hub")
+    arg_parser.add_argument("--export-onnx", action="store_true", help=f"export the model to {PATH_TO_ONNX_MODEL}")
+    arg_parser.add_argument("--parity", nargs="*", choices=BACKENDS, help="compare backends against fp32 on the master index and the existing collection")
+    arg_parser.add_argument("--sample", type=int, default=200)
+    arg_parser.add_argument("-k", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    if args.export_bundle:
+        export_bundle()
+    if args.export_onnx:
+        export_onnx()
+    if args.parity is not None:
+        parity_check(args.parity or ["int8", "onnx"], args.sample, args.k)
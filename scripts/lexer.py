@@ -0,0 +1,93 @@
+import re
+from bisect import bisect_right
+
+#one regex pass over the file, picks out everything that matters for block slicing. comments and strings are matched first so braces inside them never count
+TOKEN_PATTERN = re.compile(
+    r'(?P<comment>//[^\n]*|/\*[\s\S]*?(?:\*/|\Z))'
+    r'|(?P<string>"(?:\\.|[^"\\\n])*"?|\'(?:\\.|[^\'\\\n])*\'?)'
+    r'|(?P<brace>[{}])'
+)
+NON_NEWLINE = re.compile(r'[^\n]')
+BODY_START = re.compile(r'[{;]')
+
+def split_lines(code): #same line split as readlines(), only on \n
+    lines = code.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+        return [line + "\n" for line in lines]
+    return [line + "\n" for line in lines[:-1]] + [lines[-1]]
+
+#single pass tokenizer for solidity and cvl, builds the line offset table and brace match table once per file
+class SourceScan:
+    def __init__(self, code):
+        self.code = code
+        self.lines = split_lines(code)
+        self.line_starts = [0]
+        self.brace_match = {} #offset of '{' -> offset of its matching '}'
+
+        offset = code.find("\n")
+        while offset != -1:
+            self.line_starts.append(offset+1)
+            offset = code.find("\n", offset+1)
+
+        masked_parts = [] #same length as code, comments and string contents blanked out so regexes dont hit inside them
+        open_braces = []
+        last_end = 0
+        for match in TOKEN_PATTERN.finditer(code):
+            token = match.group()
+            start = match.start()
+            if token == "{":
+                open_braces.append(start)
+            elif token == "}":
+                if open_braces:
+                    self.brace_match[open_braces.pop()] = start
+            else: #comment or string
+                masked_parts.append(code[last_end:start])
+                masked_parts.append(NON_NEWLINE.sub(" ", token) if "\n" in token else " "*len(token))
+                last_end = match.end()
+        masked_parts.append(code[last_end:])
+        self.masked = "".join(masked_parts)
+
+    #1-based line number of an offset
+    def line_of(self, offset):
+        return bisect_right(self.line_starts, offset)
+
+    #find where the block starting at offset ends. returns offset of the closing '}' (or ';' for declarations without a body).
+    #body_start can also match keywords, a block that hits one before any brace ends right before that keyword.
+    #a match in the named group "skip" (like cvl's "filtered { ... }") jumps over the braces that follow it
+    def block_end(self, offset, body_start=BODY_START):
+        while True:
+            match = body_start.search(self.masked, offset)
+            if match is None:
+                return len(self.code)-1
+            if match.lastgroup == "skip":
+                brace = self.masked.find("{", match.end())
+                if brace == -1 or brace not in self.brace_match:
+                    return len(self.code)-1
+                offset = self.brace_match[brace]+1
+                continue
+            break
+        token = match.group()
+        if token == "{":
+            return self.brace_match.get(match.start(), len(self.code)-1) #unbalanced braces run till end of file
+        if token == ";":
+            return match.start()
+        end = match.start()-1
+        while end > offset and self.masked[end].isspace():
+            end -= 1
+        return end
+
+    #(offset of the body '{' or None for declarations without a body, offset where the declaration ends)
+    def body_span(self, offset):
+        match = BODY_START.search(self.masked, offset)
+        if match is None:
+            return None, len(self.code)-1
+        if match.group() == ";":
+            return None, match.start()
+        return match.start(), self.brace_match.get(match.start(), len(self.code)-1)
+
+    #line numbers and content of a block whose header starts at start, body is looked up from body_from onwards
+    def slice_block(self, start, body_from, body_start=BODY_START):
+        start_line = self.line_of(start)
+        end_line = self.line_of(self.block_end(body_from, body_start))
+        return start_line, end_line, self.lines[start_line-1 : end_line]
@@ -0,0 +1,113 @@
+#bm25 inverted index over the lexical side of the knowledge base: formal_property, target_function, methods_in_block and the
+#function_list of the record's contract. the vectorizer builds it next to the chroma collection, rag_agent --hybrid fuses it
+#with the dense results and --prefilter uses it to pick the candidates the dense search ranks
+
+import os
+import re
+import json
+import math
+import heapq
+from collections import Counter, defaultdict
+
+PATH_TO_LEXICAL_INDEX = os.path.join(os.getcwd(), 'DataIndex', 'lexical_index.json')
+FIELD_WEIGHTS = {"formal_property": 1, "target_function": 3, "methods_in_block": 2, "function_list": 1} #term frequency multiplier per field
+BM25_K1 = 1.2
+BM25_B = 0.75
+IDENTIFIER_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+WORD_PATTERN = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+') #camelCase and snake_case parts of an identifier
+
+#identifiers lowercased plus their parts, so balanceOf in a contract also matches balance_of and balance in a spec
+def tokenize(text):
+    tokens = []
+    for identifier in IDENTIFIER_PATTERN.findall(text):
+        tokens.append(identifier.lower())
+        parts = [part.lower() for part in WORD_PATTERN.findall(identifier) if len(part) > 1]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+def field_terms(fields):
+    terms = Counter()
+    for field, text in fields.items():
+        for token in tokenize(text):
+            terms[token] += FIELD_WEIGHTS[field]
+    return terms
+
+#master index size and mtime, the index is rebuilt when they change
+def source_stamp(master_index_path):
+    stat = os.stat(master_index_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def is_fresh(master_index_path, path=PATH_TO_LEXICAL_INDEX):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('source') == source_stamp(master_index_path)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+
+#records streamed once. function lists come from the CONTRACT_CONTEXT records, which are not indexed themselves and can show up
+#after the properties of their contract (the master is sorted by id), so they are added to the documents at the end
+def build_lexical_index(records, predicate, master_index_path, path=PATH_TO_LEXICAL_INDEX):
+    function_lists = {}
+    documents = [] #(id, source contract, term counts without the function list)
+    for record in records:
+        metadata = record.get('metadata') or {}
+        if record.get('chunk_type') == 'CONTRACT_CONTEXT':
+            function_lists[record['source_contract']] = " ".join(metadata.get('function_list') or [])
+            continue
+        if not predicate(record):
+            continue
+        target_function = record.get('target_function') or ''
+        documents.append((record['id'], record.get('source_contract'), field_terms({
+            "formal_property": record.get('formal_property') or '',
+            "target_function": target_function.replace('/', ' ') if target_function != 'ALL' else '',
+            "methods_in_block": " ".join(metadata.get('methods_in_block') or [])
+        })))
+
+    ids = []
+    lengths = []
+    postings = defaultdict(list) #term -> [[document, term frequency]]
+    for document, (record_id, source_contract, terms) in enumerate(documents):
+        terms.update(field_terms({"function_list": function_lists.get(source_contract, '')}))
+        ids.append(record_id)
+        lengths.append(sum(terms.values()))
+        for term, frequency in terms.items():
+            postings[term].append([document, frequency])
+
+    index = {
+        "source": source_stamp(master_index_path),
+        "ids": ids,
+        "lengths": lengths,
+        "average_length": sum(lengths) / len(lengths) if lengths else 0.0,
+        "postings": postings
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(path + '.tmp', path)
+    return len(ids)
+
+class LexicalIndex:
+    def __init__(self, path=PATH_TO_LEXICAL_INDEX):
+        with open(path, 'r', encoding='utf-8') as f: #FileNotFoundError if the vectorizer never built it
+            index = json.load(f)
+        self.ids = index['ids']
+        self.lengths = index['lengths']
+        self.average_length = index['average_length'] or 1.0
+        self.postings = index['postings']
+
+    def __len__(self):
+        return len(self.ids)
+
+    #[(record id, bm25 score)] of the k best records, every distinct query term counts once
+    def search(self, text, k=50):
+        scores = defaultdict(float)
+        for term in set(tokenize(text)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (len(self.ids) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for document, frequency in postings:
+                length_norm = 1 - BM25_B + BM25_B * self.lengths[document] / self.average_length
+                scores[document] += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+        return [(self.ids[document], score) for document, score in heapq.nlargest(k, scores.items(), key=lambda item: item[1])]
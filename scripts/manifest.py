@@ -0,0 +1,56 @@
+import os
+import sys
+import json
+import hashlib
+
+PATH_TO_MANIFEST = os.path.join(os.getcwd(), 'DataIndex', 'manifest.json')
+
+def sha256_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def sha256_file(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+#persistent content-hash manifest shared by parser, merger and vectorizer. one section per stage, {key: {"sha256": ..., other stage info}}
+#a stage skips a key when the hash of its input is the same as the last run
+class Manifest:
+    def __init__(self, path=PATH_TO_MANIFEST):
+        self.path = path
+        self.sections = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.sections = json.load(f)
+            except (json.JSONDecodeError, OSError) as e:
+                print(f"ignoring unreadable manifest at {path}; {e}", file=sys.stderr) #worst case everything gets reprocessed
+                self.sections = {}
+
+    def section(self, stage):
+        return self.sections.setdefault(stage, {})
+
+    def get(self, stage, key):
+        return self.section(stage).get(key)
+
+    def is_fresh(self, stage, key, digest):
+        entry = self.get(stage, key)
+        return entry is not None and entry.get('sha256') == digest
+
+    def record(self, stage, key, digest, **extra):
+        self.section(stage)[key] = {'sha256': digest, **extra}
+
+    def forget(self, stage, key):
+        self.section(stage).pop(key, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.sections, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path) #atomic, a crash mid write never leaves half a manifest
+
+def report(stage, processed, skipped):
+    print(f"{stage}: {processed} processed, {skipped} skipped (unchanged)")
@@ -0,0 +1,110 @@
+import os
+import sys
+import json
+import mmap
+
+PATH_TO_MASTER_INDEX = os.path.join(os.getcwd(), 'DataIndex', 'master_index.jsonl')
+
+#side index next to the master, {record id: [byte offset, byte length]} of its line
+def offsets_path(master_index_path):
+    return os.path.splitext(master_index_path)[0] + '.offsets.json'
+
+def encode_record(record):
+    return (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+#append-only writer, records go to disk one line at a time so nothing but the offsets is kept in memory
+#writes to a .tmp file and swaps it in on close, a failed merge leaves the previous master untouched
+class MasterIndexWriter:
+    def __init__(self, path=PATH_TO_MASTER_INDEX):
+        self.path = path
+        self.offsets = {}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.f = open(path + '.tmp', 'wb')
+
+    def append(self, record):
+        line = encode_record(record)
+        self.offsets[record['id']] = [self.f.tell(), len(line)]
+        self.f.write(line)
+
+    def close(self):
+        self.f.close()
+        tmp_offsets = offsets_path(self.path) + '.tmp'
+        with open(tmp_offsets, 'w', encoding='utf-8') as f:
+            json.dump(self.offsets, f, separators=(',', ':'))
+        os.replace(self.path + '.tmp', self.path)
+        os.replace(tmp_offsets, offsets_path(self.path))
+
+    def abort(self):
+        self.f.close()
+        os.remove(self.path + '.tmp')
+
+#read side of the master index. records are streamed line by line or fetched by id through an mmap of the file,
+#the corpus itself is never loaded as a whole
+class MasterIndex:
+    def __init__(self, path=PATH_TO_MASTER_INDEX):
+        self.path = path
+        self.f = open(path, 'rb') #FileNotFoundError if the merger never ran
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else None
+        self.offsets = self._load_offsets()
+
+    def _load_offsets(self):
+        try:
+            with open(offsets_path(self.path), 'r', encoding='utf-8') as f:
+                offsets = json.load(f)
+            if all(offset + length <= self.size() for offset, length in offsets.values()):
+                return offsets
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        print(f"offset index for {self.path} is missing or stale, rebuilding it", file=sys.stderr)
+        offsets = {}
+        for offset, line in self._lines():
+            offsets[json.loads(line)['id']] = [offset, len(line)]
+        return offsets
+
+    def size(self):
+        return len(self.mm) if self.mm is not None else 0
+
+    def _lines(self):
+        self.f.seek(0)
+        offset = 0
+        for line in self.f:
+            if line.strip():
+                yield offset, line
+            offset += len(line)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, record_id):
+        return record_id in self.offsets
+
+    def __iter__(self):
+        return self.records()
+
+    def ids(self):
+        return self.offsets.keys()
+
+    #stream records in file order, optionally only the ones predicate(record) keeps
+    def records(self, predicate=None):
+        for _, line in self._lines():
+            record = json.loads(line)
+            if predicate is None or predicate(record):
+                yield record
+
+    def get(self, record_id, default=None):
+        entry = self.offsets.get(record_id)
+        if entry is None:
+            return default
+        offset, length = entry
+        return json.loads(self.mm[offset : offset + length])
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
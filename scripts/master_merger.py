@@ -2,12 +2,17 @@ import sys
 import os
 import json
 import glob
+import heapq
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-master_list = []
-INPUT_DIR = os.path.join(os.getcwd(),'DataIndex','raw_index')
+from manifest import Manifest, sha256_file, report
+from master_index import MasterIndexWriter, encode_record, PATH_TO_MASTER_INDEX
 
-search_pattern = os.path.join(INPUT_DIR, '*.json')
-all_index_files = glob.glob(search_pattern)
+INPUT_DIR = os.path.join(os.getcwd(),'DataIndex','raw_index')
+RUNS_DIR = os.path.join(os.getcwd(),'DataIndex','merge_runs')
+MAX_OPEN_RUNS = 256 #more runs than this are merged in rounds, keeps the number of open files bounded
 
 #would have to read all individual indexes from raw_index
 def read_file(filepath):
@@ -24,19 +29,128 @@ def read_file(filepath):
         print(f"Error occured during searching of file at {filepath}; {e}", file=sys.stderr)
         return None
 
-for _filepath in all_index_files:
+def run_path(name, runs_dir=RUNS_DIR):
+    return os.path.join(runs_dir, os.path.splitext(name)[0] + '.jsonl')
+
+#one raw index -> one run, its records sorted by id as jsonl. runs are kept between merges so only changed raw indices get re-read
+#runs in a worker process, returns the record count or None if the raw index cant be read
+def sort_run(raw_path, output_path):
+    records = read_file(raw_path)
+    if records is None:
+        return None
+    records.sort(key=lambda record: record['id'])
+    with open(output_path + '.tmp', 'wb') as f:
+        for record in records:
+            f.write(encode_record(record))
+    os.replace(output_path + '.tmp', output_path)
+    return len(records)
+
+def read_run(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def write_run(records, path):
+    with open(path, 'wb') as f:
+        for record in records:
+            f.write(encode_record(record))
+
+#k-way merge of sorted runs by record id, only the head record of each run is in memory. equal ids keep run order so
+#the output only depends on the inputs. with more than MAX_OPEN_RUNS runs, groups are merged into temporary runs first
+def merge_runs(paths, tmp_dir):
+    paths = list(paths)
+    round_number = 0
+    while len(paths) > MAX_OPEN_RUNS:
+        merged_paths = []
+        for i in range(0, len(paths), MAX_OPEN_RUNS):
+            merged_path = os.path.join(tmp_dir, f"round{round_number}_{i // MAX_OPEN_RUNS}.jsonl")
+            write_run(heapq.merge(*(read_run(path) for path in paths[i:i+MAX_OPEN_RUNS]), key=lambda record: record['id']), merged_path)
+            merged_paths.append(merged_path)
+        paths = merged_paths
+        round_number += 1
+    return heapq.merge(*(read_run(path) for path in paths), key=lambda record: record['id'])
+
+#drop records already seen by id or by block hash (the same property ingested twice), first one in merge order wins
+def dedupe(records, duplicates):
+    seen_ids = set()
+    seen_hashes = set()
+    for record in records:
+        block_hash = (record.get('metadata') or {}).get('block_hash')
+        if record['id'] in seen_ids or (block_hash is not None and block_hash in seen_hashes):
+            duplicates.append(record['id'])
+            continue
+        seen_ids.add(record['id'])
+        if block_hash is not None:
+            seen_hashes.add(block_hash)
+        yield record
+
+#raw indices are sorted into runs in parallel (only the changed ones), then k-way merged into the master by id with duplicates dropped
+def merge_raw_indices(input_dir=INPUT_DIR, master_index_path=PATH_TO_MASTER_INDEX, force=False, workers=None, runs_dir=RUNS_DIR):
+    all_index_files = sorted(glob.glob(os.path.join(input_dir, '*.json')))
+    manifest = Manifest()
+    section = manifest.section('merger')
+
+    digests = {os.path.basename(filepath): sha256_file(filepath) for filepath in all_index_files}
+    unchanged = not force and os.path.exists(master_index_path) and set(digests) == set(section) and all(manifest.is_fresh('merger', name, digest) for name, digest in digests.items())
+    if unchanged:
+        report('merger', 0, len(digests))
+        return master_index_path
+
+    os.makedirs(runs_dir, exist_ok=True)
+    pending = []
+    for _filepath in all_index_files:
+        name = os.path.basename(_filepath)
+        if force or not manifest.is_fresh('merger', name, digests[name]) or not os.path.exists(run_path(name, runs_dir)):
+            pending.append(_filepath)
+
+    processed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(sort_run, _filepath, run_path(os.path.basename(_filepath), runs_dir)): _filepath for _filepath in pending}
+        for future in as_completed(futures):
+            _filepath = futures[future]
+            name = os.path.basename(_filepath)
+            try:
+                count = future.result()
+            except Exception as e:
+                count = None
+                print(f"Error occurred reading file at {_filepath}; {e}", file=sys.stderr)
+            if count is None:
+                manifest.forget('merger', name)
+                if os.path.exists(run_path(name, runs_dir)):
+                    os.remove(run_path(name, runs_dir))
+                continue
+            manifest.record('merger', name, digests[name], count=count)
+            processed += 1
+
+    for name in list(section): #raw indices that were deleted since the last run
+        if name not in digests:
+            manifest.forget('merger', name)
+            if os.path.exists(run_path(name, runs_dir)):
+                os.remove(run_path(name, runs_dir))
+
+    runs = [run_path(name, runs_dir) for name in sorted(section)]
+    duplicates = []
+    writer = MasterIndexWriter(master_index_path)
     try:
-        file_data = read_file(_filepath)
-        if file_data is not None:
-            master_list.extend(file_data)
+        with tempfile.TemporaryDirectory(dir=runs_dir) as tmp_dir:
+            for record in dedupe(merge_runs(runs, tmp_dir), duplicates):
+                writer.append(record)
     except Exception as e:
-        print(f"Error occurred reading file at {_filepath}; {e}", file=sys.stderr)
-
-master_index_path = os.path.join(os.getcwd(), 'DataIndex', 'master_index.json')
-try:
-    os.makedirs(os.path.dirname(master_index_path), exist_ok=True)
-    with open(master_index_path,'w') as f:
-        json.dump(master_list,f,indent=4)
-except Exception as e:
-    print("failed to write the master file")
-    sys.exit(1)
\ No newline at end of file
+        writer.abort()
+        print(f"failed to write the master file; {e}", file=sys.stderr)
+        sys.exit(1)
+    writer.close()
+
+    manifest.save()
+    if duplicates:
+        print(f"dropped {len(duplicates)} duplicate records (same id or block hash)", file=sys.stderr)
+    report('merger', processed, len(all_index_files)-len(pending))
+    return master_index_path
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="merge DataIndex/raw_index into the master index")
+    arg_parser.add_argument("--workers", type=int, default=None, help="processes sorting raw indices, defaults to cpu count")
+    arg_parser.add_argument("--force", action="store_true", help="re-read every raw index even if the manifest says it is unchanged")
+    args = arg_parser.parse_args()
+    merge_raw_indices(force=args.force, workers=args.workers)
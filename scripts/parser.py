@@ -5,8 +5,24 @@ import sys
 import hashlib
 from typing import Set, List, Dict
 
+from lexer import SourceScan
+from symbol_table import load_symbol_table, find_imports, SymbolTable
+
 OUTPUT_DIR = "DataIndex/raw_index"
 
+METHODS_BLOCK_PATTERN = re.compile(r"\bmethods\s*\{")
+METHOD_NAME_PATTERN = re.compile(r"^\s*([a-zA-Z0-9_\.]+)\(", re.MULTILINE)
+BLOCK_PATTERNS = {
+    "invariant": re.compile(r"\binvariant\s+(\w+)"),
+    "rule": re.compile(r"\brule\s+(\w+)")
+}
+DEFINITION_PATTERN = re.compile(r"\bdefinition\s+(\w+)")
+ASSIGNMENT_PATTERN = re.compile(r"(?:^|;)([^;=]*)=") #statement start up to its first '='
+CALL_MARK_PATTERN = re.compile(r"[(@]")
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_$][\w$]*")
+CONF_VERIFY_PATTERN = re.compile(r"^(\w+):(.+)$") #"Contract:path/to/spec" entries of a certora .conf
+SPEC_BODY_START = re.compile(r"(?P<skip>\bfiltered\b)|[{;]|\b(?:rule|invariant|definition|ghost|hook|methods|function|using|import)\b") #cvl invariants may have no body at all, they end where the next declaration starts. filters come before the body
+
 def read_file(filepath): #utility function to read file content
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
@@ -19,32 +35,14 @@ def read_file(filepath): #utility function to read file content
         return None
     
 #core solidity parsing logic, returns function in dict form
-def parse_solidity_functions(path_to_sol_file):
-    with open(path_to_sol_file,"r",encoding="utf-8") as f:
-        line_wise_code = f.readlines() #needed line wise to extract function body, also diff fnc with same name would be treated as diff functions as they all wouldh have diff line numbers    
-    code = "".join(line_wise_code)
-    functions = {}
-
-    #function_pattern = r'function\s+([a-zA-Z0-9_]+)\s*\(.*?\).*?\{.*?\}' #function regular expression
-    function_pattern = re.compile(r"function\s+(\w+)[\s\S]*?\{", re.DOTALL)
-
-    for match in function_pattern.finditer(code):
-        function_name = match.group(1)
-        start_line = code[:match.start()].count("\n")+1
-
-        open_brackets = 1
-        end_line_index = match.end()
-        while end_line_index<len(code) and open_brackets>0: #match brackets, so to avoid nested brackets inside the function
-            if code[end_line_index] == '{':
-                open_brackets+=1
-            elif code[end_line_index] == '}':
-                open_brackets-=1
-            end_line_index+=1
-
-        end_line = code[:end_line_index].count("\n")+1
-        function_body = line_wise_code[start_line-1 : end_line]
-
-        functions[function_name] = (function_name, start_line, end_line, function_body)
+def parse_solidity_functions(path_to_sol_file, table=None):
+    if table is None:
+        table = load_symbol_table(path_to_sol_file) #cached per file, already indexed with offsets
+    functions = {} #diff fnc with same name would be treated as diff functions as they all would have diff line numbers
+
+    for entry in table.function_list:
+        start_line, end_line, function_body = table.lines(entry)
+        functions[entry['name']] = (entry['name'], start_line, end_line, function_body)
     
     if not functions:
         print(f"no function found in {path_to_sol_file}")
@@ -52,62 +50,45 @@ def parse_solidity_functions(path_to_sol_file):
     return functions
 
 #find all methods names in the spec file. filter out require/assert properly
-def find_methods(file_path):
-    if not os.path.exists(file_path):
-        print(f"cant file at path: {file_path}")
-        return []
+def find_methods(file_path, scan=None):
+    if scan is None:
+        if not os.path.exists(file_path):
+            print(f"cant file at path: {file_path}")
+            return []
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        code = f.read()
+        with open(file_path, "r", encoding="utf-8") as f:
+            scan = SourceScan(f.read())
     
-    methods_block_pattern = re.compile(r"methods\s*\{[\s\S]*?\}", re.DOTALL)
-    method_name_pattern = re.compile(r"^\s*([a-zA-Z0-9_\.]+)\(", re.MULTILINE)
-
-    methods_match = methods_block_pattern.search(code)
+    methods_match = METHODS_BLOCK_PATTERN.search(scan.masked)
     methods = []
     new_methods = []
 
     if methods_match:
-        methods_block = methods_match.group()
-        methods = method_name_pattern.findall(methods_block)
+        block_end = scan.brace_match.get(methods_match.end()-1, len(scan.code)-1)
+        methods_block = scan.code[methods_match.start() : block_end+1]
+        methods = METHOD_NAME_PATTERN.findall(methods_block)
         new_methods = [method for method in methods if method not in ['require','assert']]
 
     return new_methods
 
 #parsing them cvl properties, creating the properties record
-def find_code_blocks(path_to_spec_file):
-    patterns = {
-        "invariant": re.compile(r"invariant\s+(\w+)[\s\S]*?\{", re.DOTALL),
-        "rule": re.compile(r"rule\s+(\w+)[\s\S]*?\{", re.DOTALL)
-    }
-    
+def find_code_blocks(path_to_spec_file, scan=None):
     properties = [] #list of dictionaries
-    methods = find_methods(path_to_spec_file)
 
-    if not os.path.exists(path_to_spec_file):
-        print(f"spec file does not exist at {path_to_spec_file}")
-        return properties
+    if scan is None:
+        if not os.path.exists(path_to_spec_file):
+            print(f"spec file does not exist at {path_to_spec_file}")
+            return properties
 
-    with open(path_to_spec_file, "r", encoding="utf-8") as f:
-        contract_lines = f.readlines()
+        with open(path_to_spec_file, "r", encoding="utf-8") as f:
+            scan = SourceScan(f.read())
 
-    code = "".join(contract_lines)
+    methods = find_methods(path_to_spec_file, scan) #reuse the same scan, no need to read the spec again
 
-    for block_type,pattern in patterns.items():
-        for match in pattern.finditer(code):
+    for block_type,pattern in BLOCK_PATTERNS.items():
+        for match in pattern.finditer(scan.masked):
             block_name = match.group(1)
-            start_line = code[:match.start()].count("\n")+1
-            open_brackets = 1
-            end_line_index = match.end()
-            while end_line_index < len(code) and open_brackets>0:
-                if code[end_line_index]=="{":
-                    open_brackets+=1
-                elif code[end_line_index]=="}":
-                    open_brackets-=1
-                end_line_index+=1
-            
-            end_line = code[:end_line_index].count("\n")+1
-            block_content = contract_lines[start_line-1: end_line]
+            start_line, end_line, block_content = scan.slice_block(match.start(), match.end(), SPEC_BODY_START)
             block_content_str = "".join(block_content)
 
             methods_in_block = [method for method in methods if method in block_content_str]
@@ -127,37 +108,45 @@ def find_code_blocks(path_to_spec_file):
     
     return properties
 
-#function to extract all state vars in solidity code, imp to monitor the state of contract. lexer
-def extract_state_variables(path_to_sol_file):
-    with open(path_to_sol_file, "r", encoding='utf-8') as f:
-        contract_lines = f.readlines()
-    
-    sol_code = "".join(contract_lines)
-
-    state_vars = set()
+#cvl definitions, not indexed themselves but rules/invariants using them get their lines during cross referencing
+def find_definitions(path_to_spec_file, scan=None):
+    if scan is None:
+        with open(path_to_spec_file, "r", encoding="utf-8") as f:
+            scan = SourceScan(f.read())
+
+    definitions = []
+    for match in DEFINITION_PATTERN.finditer(scan.masked):
+        start_line, end_line, block_content = scan.slice_block(match.start(), match.end(), SPEC_BODY_START)
+        definitions.append({
+            'block_type':'definition',
+            'block_name':match.group(1),
+            'start_line':start_line,
+            'end_line':end_line,
+            'block_content':block_content
+        })
+    return definitions
 
-    patterns = [
-        r'(?:public|private|internal|external)\s+(\w+)\s*;',
-        r'(?:uint|int|bool|address|string|bytes)\d*\s+(?:public|private|internal)?\s*(\w+)\s*;',
-        r'mapping\s*\([^)]+\)\s+(?:public|private|internal)?\s*(\w+)\s*;'
-    ]
+#function to extract all state vars in solidity code, imp to monitor the state of contract. only contract level declarations count, locals inside functions are not state
+def extract_state_variables(path_to_sol_file):
+    return load_symbol_table(path_to_sol_file).all_state_variables()
 
-    for pattern in patterns:
-        matches = re.findall(pattern, sol_code)
-        state_vars.update(matches)
-    
-    return state_vars
+#one regex for all state vars of a contract, matches any of them as a whole word
+def compile_state_var_pattern(state_vars: Set[str]):
+    if not state_vars:
+        return None
+    names = sorted(state_vars, key=len, reverse=True)
+    return re.compile(r'\b(?:' + '|'.join(re.escape(var) for var in names) + r')\b')
 
 #check if the function has any state variable assignment, we need this as we only wanna keep properties that verify functions that modify state variables. i.e. not just getter functions but functions that are actually changing state on the chain
-def check_state_var_assignment(function_body: str, state_vars: Set[str]):
-    nodes = function_body.split(';')
-
-    for node in nodes:
-        if '=' in node:
-            left_side = node.split('=')[0].strip()
-            for var in state_vars:
-                if re.search(r'\b' + re.escape(var) + r'\b', left_side):
-                    return True
+def check_state_var_assignment(function_body: str, state_vars: Set[str], state_var_pattern=None):
+    if state_var_pattern is None:
+        state_var_pattern = compile_state_var_pattern(state_vars)
+    if state_var_pattern is None:
+        return False
+
+    for match in ASSIGNMENT_PATTERN.finditer(function_body): #left side of every statement that has an '='
+        if state_var_pattern.search(match.group(1)):
+            return True
             
     return False
 
@@ -168,10 +157,10 @@ def has_function_calls(function_body):
     
     #extract content between {...}
     match = re.search(r'\{(.*)\}', str(function_body), re.DOTALL)
-    start_index = match.end()
-
-    if not match:
+    if not match: #declarations without a body
         return False
+
+    start_index = match.end()
     
     function_lines = function_body.split('\n')
     
@@ -205,49 +194,95 @@ def has_function_calls(function_body):
     
     return False
 
-#make each block self-contained by expanding it to include all non-duplicate lines of fnc it references
-def update_blocks_with_cross_reference(code_blocks:List[dict]):
-    def find_block_by_name(name):
-        for block in code_blocks:
-            if block['block_name'] == name:
-                return block
-        return None
-    
-    def update_block_content(block, visited=None):
-        if visited is None:
-            visited = set()
-        
-        if block['block_name'] in visited:
-            return []
-    
-        visited.add(block['block_name']) #maintain a visited to know what codes are already being included...do this to avoid duplicacy
-        updated_content = []
+#per contract analysis pass, {function name: modifies state}. every function is analysed exactly once so create_index_records only does lookups
+def analyze_functions(solidity_functions, state_vars):
+    state_var_pattern = compile_state_var_pattern(state_vars)
+    analysis = {}
+    for func_name, (_, _, _, body_lines) in solidity_functions.items():
+        func_body = "".join(body_lines)
+        analysis[func_name] = has_function_calls(func_body) or check_state_var_assignment(func_body, state_vars, state_var_pattern)
+    return analysis
 
+#make each block self-contained by expanding it to include all non-duplicate lines of fnc it references
+#names are matched once per line as whole identifiers and turned into a reference graph (rules, invariants and cvl definitions), each block's expansion is memoized so shared references are only expanded once
+def update_blocks_with_cross_reference(code_blocks:List[dict], definitions:List[dict]=()):
+    graph_blocks = list(code_blocks) + list(definitions)
+    index_by_name = {}
+    for i, block in enumerate(graph_blocks):
+        index_by_name.setdefault(block['block_name'], i) #first block wins for duplicate names
+
+    contents = [block['block_content'] for block in graph_blocks] #original content, blocks get replaced below
+
+    #for every line of every block, the blocks it references, kept in block order
+    references = []
+    for block in graph_blocks:
+        own_index = index_by_name[block['block_name']]
+        line_refs = []
         for line in block['block_content']:
-            if line not in updated_content:
-                updated_content.append(line)
-            
-            for other_block in code_blocks:
-                if other_block['block_name'] in line and other_block['block_name'] != block['block_name']:
-                    referenced_block = find_block_by_name(other_block['block_name'])
-                    if referenced_block:
-                        ref_block_content = update_block_content(referenced_block, visited)
-                        for ref_line in ref_block_content:
-                            if ref_line not in updated_content:
-                                updated_content.append(ref_line)
-        
-        return updated_content
-    
-    for block in code_blocks:
-        block['block_content'] = update_block_content(block)
+            refs = {index_by_name[name] for name in IDENTIFIER_PATTERN.findall(line) if name in index_by_name}
+            refs.discard(own_index)
+            line_refs.append(sorted(refs))
+        references.append(line_refs)
+
+    expanded = {} #only blocks whose expansion did not hit a reference cycle are memoized
+    def update_block_content(i, in_progress):
+        if i in expanded:
+            return expanded[i], True
+
+        in_progress.add(i) #blocks currently being expanded, breaks reference cycles
+        updated_content = {} #dict as an ordered set of lines, avoids duplicacy
+        complete = True
+        for line, refs in zip(contents[i], references[i]):
+            updated_content.setdefault(line)
+            for ref in refs:
+                if ref in in_progress:
+                    complete = False
+                    continue
+                ref_content, ref_complete = update_block_content(ref, in_progress)
+                updated_content.update(dict.fromkeys(ref_content))
+                complete = complete and ref_complete
+        in_progress.discard(i)
+
+        if complete:
+            expanded[i] = tuple(updated_content)
+        return tuple(updated_content), complete
+
+    for i, block in enumerate(code_blocks):
+        block['block_content'] = list(update_block_content(i, set())[0])
 
 #to generate unique hash for each code block
 def generate_block_hash(block:dict):
     block_content_string = str(block)
     return hashlib.md5(block_content_string.encode()).hexdigest()
 
+#reversed trie of the lowercased function names of one contract, compiled once and reused for every property.
+#a call site is a '(' or '@' with a function name right before it, so the trie is walked backwards from each of those
+class CallSiteMatcher:
+    def __init__(self, function_names):
+        self.trie = {}
+        for name in function_names:
+            node = self.trie
+            for char in reversed(name.lower()):
+                node = node.setdefault(char, {})
+            node.setdefault(None, []).append(name) #None key holds the names that end at this node
+
+    #single scan of the (lowercased) property body, returns every (offset, function name) call site in order
+    def find_call_sites(self, body_lower):
+        call_sites = []
+        for match in CALL_MARK_PATTERN.finditer(body_lower):
+            node = self.trie
+            position = match.start()-1
+            while position >= 0:
+                node = node.get(body_lower[position])
+                if node is None:
+                    break
+                for func_name in node.get(None, ()):
+                    call_sites.append((position, func_name))
+                position -= 1
+        return call_sites
+
 #function to link cvl property to its target function, very imp, returns set of target functions linked to that property
-def determine_target_function(prop_body, all_solidity_functions, methods_in_block):
+def determine_target_function(prop_body, all_solidity_functions, methods_in_block, matcher=None):
     target_fncs = set()
     body_lower = prop_body.lower()
     
@@ -257,11 +292,11 @@ def determine_target_function(prop_body, all_solidity_functions, methods_in_bloc
         if clean_method in all_solidity_functions:
             target_fncs.add(clean_method)
 
-    #also check for direct func refernces in the property body
-    for func_name in all_solidity_functions.keys():
-        func_lower = func_name.lower()
-        if f"{func_lower}(" in body_lower or f"{func_lower}@" in body_lower:
-            target_fncs.add(func_name)
+    #also check for direct func refernces (name( or name@) in the property body
+    if matcher is None:
+        matcher = CallSiteMatcher(all_solidity_functions.keys())
+    for _, func_name in matcher.find_call_sites(body_lower):
+        target_fncs.add(func_name)
         
     #make invariant global if no specific fnc is called, cuz invariant holds true for any function
     if not target_fncs and "invariant" in body_lower:
@@ -289,8 +324,10 @@ def create_index_records(solidity_functions, formal_properties, full_sol_code, s
     })
 
     #now store property specific data for formal properties
+    matcher = CallSiteMatcher(solidity_functions.keys()) #function names compiled once per contract
+    analysis = analyze_functions(solidity_functions, state_vars)
     for prop in formal_properties:
-        target_func_str = determine_target_function("".join(prop['block_content']), solidity_functions, prop['methods_in_block'])
+        target_func_str = determine_target_function("".join(prop['block_content']), solidity_functions, prop['methods_in_block'], matcher)
         solcode_chunk = ""
         target_func_names = target_func_str.split('/')
 
@@ -305,13 +342,7 @@ def create_index_records(solidity_functions, formal_properties, full_sol_code, s
             solcode_chunk = "\n\n".join(func_bodies) if func_bodies else full_sol_code
 
         #determine if state variables are modified
-        modifies_state = False
-        for func_name in target_func_names:
-            if func_name in solidity_functions:
-                func_body = "".join(solidity_functions[func_name][3])
-                if check_state_var_assignment(func_body, state_vars) or has_function_calls(func_body):
-                    modifies_state = True
-                    break
+        modifies_state = any(analysis[func_name] for func_name in target_func_names if func_name in analysis)
         
         chunk_type = "CONTRACT_INVARIANT" if prop['block_type']=="invariant" else "FUNCTION_RULE"
         block_hash = generate_block_hash(prop)
@@ -338,21 +369,18 @@ def create_index_records(solidity_functions, formal_properties, full_sol_code, s
 
     return records #in records we store the sol code contract index rec and property's index data as well, specific for each property
 
-def main():
-    if len(sys.argv) != 3:
-        print("ssage: python parser.py <solidity_file_path> <spec_file_path>", file=sys.stderr)
-        print("eg: python parser.py ContractsAndProperties/Auction.sol ContractsAndProperties/Auction.spec", file=sys.stderr)
-        sys.exit(1)
-    
-    #paths to all files
-    sol_path = sys.argv[1]
-    spec_path = sys.argv[2]
+#where the index of a .sol file would be saved, by this name in DataIndex/raw_index
+def index_output_path(sol_path, output_dir=OUTPUT_DIR):
+    base_name = os.path.splitext(os.path.basename(sol_path))[0]
+    return os.path.join(output_dir, f"{base_name}_index.json")
+
+#a standalone pair is its own project, named after its .sol like its index file, so --project filters work without project mode
+def pair_project(sol_path):
+    return os.path.splitext(os.path.basename(sol_path))[0]
 
-    #path thingy
+#whole parsing pipeline for one .sol/.spec pair, returns the index records. raises ValueError if the files cant be read
+def parse_pair(sol_path, spec_path):
     source_contract_name = os.path.basename(sol_path)
-    base_name = os.path.splitext(source_contract_name)[0]
-    output_index_name = f"{base_name}_index.json" #would be saved by this name in DataIndex/raw_index
-    output_path = os.path.join(OUTPUT_DIR, output_index_name)
 
     #reading the whole code
     full_sol_code = read_file(sol_path)
@@ -360,33 +388,279 @@ def main():
 
     #if code doesnt even exist, fallback
     if not full_sol_code or not full_spec_code:
-        print("failed to read input files")
-        sys.exit(1)
+        raise ValueError(f"failed to read input files {sol_path}, {spec_path}")
 
-    solidity_functions = parse_solidity_functions(sol_path) #extract all functions from the solidity code given
-    formal_properties = find_code_blocks(spec_path) #extract all properties (rules,invariants) from the cvl spec file
+    spec_scan = SourceScan(full_spec_code)
+    table = load_symbol_table(sol_path)
+    solidity_functions = parse_solidity_functions(sol_path, table) #extract all functions from the solidity code given
+    formal_properties = find_code_blocks(spec_path, spec_scan) #extract all properties (rules,invariants) from the cvl spec file
 
     #expand proeprties with cross ref
-    update_blocks_with_cross_reference(formal_properties)
+    update_blocks_with_cross_reference(formal_properties, find_definitions(spec_path, spec_scan))
 
     #extract state vars
-    state_vars = extract_state_variables(sol_path)
+    state_vars = table.all_state_variables()
 
     #create index recs
-    index_records = create_index_records(
+    records = create_index_records(
         solidity_functions,
         formal_properties,
         full_sol_code,
         source_contract_name,
         state_vars
     )
-
-    #save to file
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    for record in records:
+        record['metadata']['project'] = pair_project(sol_path)
+    return records
+
+#project mode: every .sol under a root is parsed once into one table per file, imports become a dependency graph
+#and each .spec gets its main contract plus everything that contract imports instead of a single file
+class SolidityProject:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.tables = {} #path -> SymbolTable, each file parsed exactly once
+        self.by_basename = {}
+        self.specs = []
+        self.confs = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.') and d != 'node_modules')
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                if filename.endswith('.sol'):
+                    code = read_file(path)
+                    if code is None:
+                        continue
+                    self.tables[path] = SymbolTable(code, path)
+                    self.by_basename.setdefault(filename, []).append(path)
+                elif filename.endswith('.spec'):
+                    self.specs.append(path)
+                elif filename.endswith('.conf'):
+                    self.confs.append(path)
+
+        #import graph, path -> resolved paths in import order. unresolved imports (packages not vendored in the project) are dropped
+        self.imports = {}
+        for path, table in self.tables.items():
+            resolved = (self.resolve_import(path, raw_path) for raw_path in table.imports)
+            self.imports[path] = list(dict.fromkeys(dep for dep in resolved if dep is not None))
+
+        #contract name -> file declaring it, a file named after the contract wins over one that merely declares it too
+        self.contract_files = {}
+        self._inherited = {}
+        for path, table in self.tables.items():
+            for name in table.contracts:
+                current = self.contract_files.get(name)
+                if current is None or (os.path.basename(current) != name + '.sol' and os.path.basename(path) == name + '.sol'):
+                    self.contract_files[name] = path
+
+    #relative imports resolve against the importing file, then the project root, then remapped/package paths
+    #("@openzeppelin/contracts/token/ERC20/IERC20.sol") fall back to the file sharing the longest path suffix with it
+    def resolve_import(self, importer, raw_path, candidates=None):
+        if candidates is None:
+            candidates = self.by_basename.get(os.path.basename(raw_path), [])
+        for path in (os.path.join(os.path.dirname(importer), raw_path), os.path.join(self.root, raw_path)):
+            path = os.path.normpath(path)
+            if path in candidates:
+                return path
+        parts = os.path.normpath(raw_path).split(os.sep)
+        best = None
+        best_length = 0
+        for candidate in candidates:
+            candidate_parts = candidate.split(os.sep)
+            length = 0
+            while length < min(len(parts), len(candidate_parts)) and parts[-1-length] == candidate_parts[-1-length]:
+                length += 1
+            if length > best_length:
+                best, best_length = candidate, length
+        return best
+
+    #transitive imports of a file, dependencies before the files importing them and the file itself last
+    def closure(self, path):
+        order = []
+        seen = set()
+        stack = [(path, iter(self.imports.get(path, ())))]
+        seen.add(path)
+        while stack:
+            current, deps = stack[-1]
+            for dep in deps:
+                if dep not in seen:
+                    seen.add(dep)
+                    stack.append((dep, iter(self.imports.get(dep, ()))))
+                    break
+            else:
+                stack.pop()
+                order.append(current)
+        return order
+
+    #contract a .spec verifies: the .conf that runs it, then a contract named after the spec (or its harness),
+    #then the contract implementing most of the methods block. returns the contract name or None
+    def main_contract(self, spec_path, methods):
+        spec_name = os.path.basename(spec_path)
+        for conf_path in self.confs:
+            try:
+                with open(conf_path, 'r', encoding='utf-8') as f:
+                    verify = json.load(f).get('verify', [])
+            except (json.JSONDecodeError, OSError, AttributeError):
+                continue
+            for entry in ([verify] if isinstance(verify, str) else verify):
+                match = CONF_VERIFY_PATTERN.match(str(entry).strip())
+                if match and os.path.basename(match.group(2)) == spec_name and match.group(1) in self.contract_files:
+                    return match.group(1)
+
+        spec_base = os.path.splitext(spec_name)[0].lower()
+        contracts = [name for name, path in self.contract_files.items() if self.tables[path].contracts[name]['kind'] == 'contract']
+        for wanted in (spec_base + 'harness', spec_base):
+            for name in contracts:
+                if name.lower() == wanted:
+                    return name
+        named = sorted((name for name in contracts if spec_base in name.lower()), key=len)
+        if named:
+            return named[0]
+
+        method_names = {method.split('.')[-1] for method in methods}
+        best = None
+        best_overlap = 0
+        for name in sorted(contracts):
+            overlap = len(method_names & self.inherited_functions(name))
+            if overlap > best_overlap:
+                best, best_overlap = name, overlap
+        return best
+
+    #names of the functions a contract declares or inherits from bases found in the project, memoized per contract
+    def inherited_functions(self, name, in_progress=None):
+        if name in self._inherited:
+            return self._inherited[name]
+        in_progress = set() if in_progress is None else in_progress
+        in_progress.add(name)
+        table = self.tables[self.contract_files[name]]
+        names = {entry['name'] for entry in table.function_list if entry['contract'] == name}
+        for base in table.contracts[name]['bases']:
+            base = base.split('.')[-1]
+            if base in self.contract_files and base not in in_progress:
+                names |= self.inherited_functions(base, in_progress)
+        self._inherited[name] = names
+        return names
+
+    #functions of a file and everything it imports, files later in the closure override earlier ones (so the main file wins)
+    #and a body-less declaration never replaces an implementation
+    def functions(self, paths):
+        functions = {}
+        has_body = {}
+        for path in paths:
+            table = self.tables[path]
+            for entry in table.function_list:
+                if has_body.get(entry['name']) and entry['body_start'] is None:
+                    continue
+                start_line, end_line, function_body = table.lines(entry)
+                functions[entry['name']] = (entry['name'], start_line, end_line, function_body)
+                has_body[entry['name']] = entry['body_start'] is not None
+        return functions
+
+    def relative(self, path):
+        return os.path.relpath(path, self.root)
+
+    #main file plus its imports, each headed by its path so the chunk still says where code came from
+    def full_code(self, paths):
+        return "\n".join(f"// file: {self.relative(path)}\n{self.tables[path].code}" for path in paths)
+
+    #definitions of a spec and the specs it imports (cvl import paths are relative to the spec)
+    def spec_definitions(self, spec_path, spec_scan, seen=None):
+        seen = set() if seen is None else seen
+        seen.add(spec_path)
+        definitions = find_definitions(spec_path, spec_scan)
+        spec_candidates = [path for path in self.specs if path not in seen]
+        for raw_path in find_imports(spec_scan):
+            dep = self.resolve_import(spec_path, raw_path, [path for path in spec_candidates if os.path.basename(path) == os.path.basename(raw_path)])
+            if dep is None or dep in seen:
+                continue
+            dep_code = read_file(dep)
+            if dep_code:
+                definitions.extend(self.spec_definitions(dep, SourceScan(dep_code), seen))
+        return definitions
+
+    #records for one spec, None if the spec has no rules/invariants or no contract could be matched to it
+    def parse_spec(self, spec_path):
+        full_spec_code = read_file(spec_path)
+        if not full_spec_code:
+            return None, None
+        spec_scan = SourceScan(full_spec_code)
+        formal_properties = find_code_blocks(spec_path, spec_scan)
+        if not formal_properties:
+            return None, None
+        contract_name = self.main_contract(spec_path, find_methods(spec_path, spec_scan))
+        if contract_name is None:
+            print(f"no contract found for {spec_path}", file=sys.stderr)
+            return None, None
+
+        paths = self.closure(self.contract_files[contract_name])
+        update_blocks_with_cross_reference(formal_properties, self.spec_definitions(spec_path, spec_scan))
+        state_vars = set()
+        for path in paths:
+            state_vars |= self.tables[path].all_state_variables()
+
+        records = create_index_records(
+            self.functions(paths),
+            formal_properties,
+            self.full_code(paths),
+            os.path.basename(self.contract_files[contract_name]),
+            state_vars
+        )
+        return contract_name, records
+
+#records for every spec of a project in one pass, returns [(spec_path, contract name, output_path, records)]. index files are named after the spec since
+#several specs can verify the same contract
+def parse_project(root, output_dir=OUTPUT_DIR):
+    project = SolidityProject(root)
+    project_name = os.path.basename(project.root)
+    results = []
+    used_names = set()
+    for spec_path in project.specs:
+        contract_name, records = project.parse_spec(spec_path)
+        if records is None:
+            continue
+        for record in records:
+            record['metadata']['project'] = project_name #lets retrieval be limited to some projects
+        spec_base = os.path.splitext(project.relative(spec_path))[0].replace(os.sep, '_')
+        name = f"{project_name}_{os.path.basename(spec_base)}"
+        if name in used_names:
+            name = f"{project_name}_{spec_base}"
+        used_names.add(name)
+        results.append((spec_path, contract_name, os.path.join(output_dir, f"{name}_index.json"), records))
+    print(f"{project_name}: {len(project.tables)} .sol files parsed, {len(results)} of {len(project.specs)} specs indexed")
+    return results
+
+def write_index(index_records, output_path):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
     with open(output_path,'w') as f:
         json.dump(index_records, f, indent=4, ensure_ascii=False)
 
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--project":
+        for spec_path, contract_name, output_path, index_records in parse_project(sys.argv[2]):
+            write_index(index_records, output_path)
+            print(f"{spec_path} ({contract_name}) -> {output_path}")
+        return
+
+    if len(sys.argv) != 3:
+        print("ssage: python parser.py <solidity_file_path> <spec_file_path>", file=sys.stderr)
+        print("   or: python parser.py --project <project_root>", file=sys.stderr)
+        print("eg: python parser.py ContractsAndProperties/Auction.sol ContractsAndProperties/Auction.spec", file=sys.stderr)
+        sys.exit(1)
+    
+    #paths to all files
+    sol_path = sys.argv[1]
+    spec_path = sys.argv[2]
+    output_path = index_output_path(sol_path)
+
+    try:
+        index_records = parse_pair(sol_path, spec_path)
+    except ValueError:
+        print("failed to read input files")
+        sys.exit(1)
+
+    #save to file
+    write_index(index_records, output_path)
+
     print(f"succesfully generated and saved at {output_path}")
 
 if __name__ == "__main__":
-    main()
+    main()
\ No newline at end of file
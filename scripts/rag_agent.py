@@ -1,26 +1,47 @@
+import time
+STARTED = time.perf_counter() #before anything else is imported, --timings counts module imports too
+
 import os
 import sys
-from transformers import AutoTokenizer, AutoModel
-import torch
 import json
-import numpy as np
 import re
-import chromadb
+from contextlib import contextmanager
 
-MODEL_NAME = "microsoft/codebert-base"
-PATH_TO_CHROMA_DB = os.path.join(os.getcwd(), 'DataIndex', 'chroma_db')
 BATCH_SIZE = 32
+RAG_SERVER_HOST = "127.0.0.1"
+RAG_SERVER_PORT = int(os.environ.get("SCRIA_RAG_PORT", "8765")) #rag_server.py listens here, app.js runs this script without flags
+RAG_SERVER_TIMEOUT = 60 #seconds, a long contract on a busy server can take a while to embed
+QUERY_BATCH = 64 #contracts embedded together and searched with one collection.query in batch mode
+FUNCTION_HITS = 10 #neighbours fetched per function in --functions mode before they are fused into one list
+FUSION_DEPTH = 50 #results taken from the dense and the bm25 ranking before reciprocal rank fusion
+RRF_K = 60 #usual reciprocal rank fusion constant, keeps one list's top hit from drowning the other list
+PREFILTER_SIZE = 200 #bm25 candidates the dense search ranks with --prefilter
+WINDOW_HITS = 4 #window neighbours fetched per result wanted, several windows of one long record tend to be close to the same query
+FILTER_FIELDS = {"chunk_type": str, "rule_type": str, "modifies_state": bool, "project": str, "rule_name": str, "source_contract": str} #filterable metadata and its type
 
-path_to_contract = sys.argv[1] #takes the path as input as its been called by app.js with path as CLI argument
+#wall time of each cold start stage of a one shot query, printed to stderr with --timings
+class StartupTimings:
+    def __init__(self):
+        self.stages = [("python imports", time.perf_counter() - STARTED)]
 
-def setup_enviornment():
-    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+    @contextmanager
+    def stage(self, label):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((label, time.perf_counter() - started))
 
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    model = AutoModel.from_pretrained(MODEL_NAME).to(device)
-    model.eval()
+    def report(self):
+        for label, seconds in self.stages:
+            print(f"{label:<22} {1000*seconds:>9.1f} ms", file=sys.stderr)
+        print(f"{'first query total':<22} {1000*(time.perf_counter() - STARTED):>9.1f} ms", file=sys.stderr)
 
-    return tokenizer,model,device
+#backend comes from SCRIA_ENCODER (fp32, int8 or onnx), see encoder.py
+#torch, transformers and the vector store are only imported once we know the server cant answer, so the warm path stays cheap
+def setup_enviornment(backend=None):
+    from encoder import load_encoder, DEFAULT_BACKEND
+    return load_encoder(backend or DEFAULT_BACKEND)
 
 def read_contract(path):
     try:
@@ -38,57 +59,527 @@ def clean_code(code_chunk):
     code_chunk = re.sub(r'\s+', ' ', code_chunk).strip()
     return code_chunk
 
-def generate_query_vector(tokenizer,model,device,code_chunk):
-    client = chromadb.PersistentClient(path = PATH_TO_CHROMA_DB)
-    collection = client.get_or_create_collection(name="scria_knowledge_base")
+#the server keeps one cache open and saves it itself, one shot runs open and save their own. checked means the caller already
+#looked the query up and missed, so the lookup is not repeated (and not counted twice)
+def generate_query_vector(tokenizer,model,device,code_chunk,cache=None,checked=False):
+    from embedding_cache import EmbeddingCache, cache_key
+    from encoder import encoder_id, embed_texts, POOLING #queries are embedded exactly like the indexed records, long contracts included
+    owns_cache = cache is None
+    if owns_cache:
+        cache = EmbeddingCache()
 
     text_to_embed = clean_code(code_chunk)
-    input = tokenizer(
-        [text_to_embed], 
-        return_tensors="pt", 
-        padding=True, 
-        truncation=True 
-    ).to(device)
-
-    with torch.no_grad():
-        model.eval()
-        output = model(**input)
-        query_vector = output.last_hidden_state[:, 0, :].cpu().tolist()
-        
-    return query_vector
-    
-def top_n_metadata_retrieval(code_chunk,n):
-    #load model
-    tokenizer,model,device = setup_enviornment()
 
-    #generate the query vector of the code passed
-    query_vector = generate_query_vector(tokenizer,model,device,code_chunk)
+    #same contract asked about again, no need to run the model
+    key = cache_key(encoder_id(model), POOLING, text_to_embed)
+    cached = None if checked else cache.get(key)
+    if cached is not None:
+        if owns_cache:
+            cache.save() #keeps the lru order
+        return [cached.tolist()]
 
-    #connect to database
+    #contracts longer than one window are pooled over all of their windows instead of being cut at 512 tokens
+    pooled, _ = embed_texts(tokenizer, model, device, [text_to_embed], cache=cache)
+    query_vector = [pooled[0]]
+
+    cache.put(key, query_vector[0])
+    if owns_cache:
+        cache.save()
+    return query_vector
+
+#chroma or the numpy store, SCRIA_VECTOR_STORE picks it (see vector_store.py)
+def open_collection(store=None):
+    from vector_store import open_store, KNOWLEDGE_BASE
     try:
-        client = chromadb.PersistentClient(path=PATH_TO_CHROMA_DB)
-        collection = client.get_collection('scria_knowledge_base')
-        if(collection.count==0):
-            print("collection doesnt exist, run vectorizer.py to create the collection")
-            return
+        collection = open_store(KNOWLEDGE_BASE, store)
+        if(collection.count()==0):
+            print("collection doesnt exist, run vectorizer.py to create the collection", file=sys.stderr)
+            return None
     except Exception as e:
-        print(f"error occured: {e}")
-        return
-    
-    #perform semantic search
+        print(f"error occured: {e}", file=sys.stderr)
+        return None
+    return collection
+
+#window vectors of the records longer than one window (vectorizer.py), None when there are none
+def open_windows(store=None):
+    from vector_store import open_store, WINDOWS_COLLECTION
+    try:
+        windows = open_store(WINDOWS_COLLECTION, store)
+        return windows if windows.count() else None
+    except Exception:
+        return None
+
+#hits and misses of the query vectors themselves. embed_texts looks up the windows of every embedded query in the same cache,
+#so the cache's own counters mix both, the window numbers are whatever is left
+class QueryCounts:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, vectors):
+        found = sum(vector is not None for vector in vectors)
+        self.hits += found
+        self.misses += len(vectors) - found
+
+    def report(self, cache):
+        return f"query vectors: {self.hits} hits, {self.misses} misses, windows: {cache.hits - self.hits} hits, {cache.misses - self.misses} misses, {len(cache)}/{cache.max_entries} entries"
+
+#filters are {metadata field: allowed values}. one value is $eq and several are $in, several fields are $and. the clause runs
+#inside chroma's search, so n results come back even when most of the collection is filtered out
+def build_where(filters):
+    conditions = []
+    for field, values in sorted((filters or {}).items()):
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"unknown filter {field}, expected one of {', '.join(FILTER_FIELDS)}")
+        values = list(values) if isinstance(values, (list, tuple, set)) else [values]
+        if not all(isinstance(value, FILTER_FIELDS[field]) for value in values):
+            raise ValueError(f"filter {field} takes {FILTER_FIELDS[field].__name__} values, got {values}")
+        if values:
+            conditions.append({field: {"$eq": values[0]}} if len(values) == 1 else {field: {"$in": values}})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+#the same filters checked in python, for the over-fetch comparison
+def matches_filters(metadata,filters):
+    for field, values in (filters or {}).items():
+        values = list(values) if isinstance(values, (list, tuple, set)) else [values]
+        if values and (metadata or {}).get(field) not in values:
+            return False
+    return True
+
+#perform semantic search. with the windows collection a long record is also found through its windows, see pool_windows
+def search(collection,query_vector,n,filters=None,windows=None):
+    where = build_where(filters)
     results = collection.query(
         query_embeddings=query_vector,
         n_results=n,
-        include=['metadatas','distances']
+        include=['metadatas','distances'],
+        **({"where": where} if where else {})
     )
+    if windows is None:
+        return results
+    return pool_windows(collection,windows,query_vector,results,n,where)
+
+#window hits are max pooled per parent record: a record's distance is the smallest over its pooled vector and its windows, so a
+#contract matching one part of a long record still finds it when the average over all of the record is further away.
+#windows carry no filter fields, parents only found through a window go through the where clause when their metadata is read
+def pool_windows(collection,windows,query_vector,results,n,where=None):
+    hits = windows.query(query_embeddings=query_vector, n_results=min(n * WINDOW_HITS, windows.count()), include=['metadatas','distances'])
+    closest = [] #{parent id: smallest window distance} per query
+    for metadatas, distances in zip(hits['metadatas'], hits['distances']):
+        best = {}
+        for metadata, distance in zip(metadatas, distances):
+            best[metadata['parent_id']] = min(distance, best.get(metadata['parent_id'], distance))
+        closest.append(best)
+    parents = sorted({parent for best in closest for parent in best})
+    stored = collection.get(ids=parents, include=['metadatas'], **({"where": where} if where else {})) if parents else {"ids": [], "metadatas": []}
+    allowed = dict(zip(stored['ids'], stored['metadatas']))
+
+    pooled = {"ids": [], "metadatas": [], "distances": []}
+    for ids, metadatas, distances, best in zip(results['ids'], results['metadatas'], results['distances'], closest):
+        entries = {record_id: (distance, metadata) for record_id, metadata, distance in zip(ids, metadatas, distances)}
+        for parent, distance in best.items():
+            if parent in entries:
+                entries[parent] = (min(distance, entries[parent][0]), entries[parent][1])
+            elif parent in allowed:
+                entries[parent] = (distance, allowed[parent])
+        ranked = sorted(entries.items(), key=lambda item: item[1][0])[:n]
+        pooled["ids"].append([record_id for record_id, _ in ranked])
+        pooled["distances"].append([distance for _, (distance, _) in ranked])
+        pooled["metadatas"].append([metadata for _, (_, metadata) in ranked])
+    return pooled
+
+#key of a whole contract's query vector in the embedding cache, the same key generate_query_vector stores it under. backend_id
+#gives the model's name without loading it, so a repeated query finds its vector without the model
+def query_cache_key(code_chunk,backend=None):
+    from embedding_cache import cache_key
+    from encoder import backend_id, POOLING, DEFAULT_BACKEND
+    return cache_key(backend_id(backend or DEFAULT_BACKEND), POOLING, clean_code(code_chunk))
+
+#one store handle for the whole run, the model is only loaded when the query vector is not cached and then from the local
+#bundle when there is one (encoder.py --export-bundle)
+def top_n_metadata_retrieval(code_chunk,n,timings=None,verbose=False,hybrid=False,prefilter=False,filters=None):
+    from embedding_cache import EmbeddingCache
+    timings = timings or StartupTimings()
+
+    #connect to database
+    with timings.stage("open collection"):
+        collection = open_collection()
+        windows = open_windows()
+    if collection is None:
+        return
+
+    #same contract as an earlier run, straight to the search
+    with timings.stage("embedding cache"):
+        cache = EmbeddingCache()
+        cached = cache.get(query_cache_key(code_chunk))
+        counts = QueryCounts()
+        counts.add([cached])
+
+    if cached is not None:
+        query_vector = [cached.tolist()]
+    else:
+        #load model
+        with timings.stage("load model"):
+            tokenizer,model,device = setup_enviornment()
+
+        #generate the query vector of the code passed
+        with timings.stage("embed query"):
+            query_vector = generate_query_vector(tokenizer,model,device,code_chunk,cache,checked=True)
+    cache.save() #lru order, new vectors were saved when they were put
+    if verbose:
+        print(f"query vector: {'cached, model not loaded' if cached is not None else 'embedded'} ({counts.report(cache)})", file=sys.stderr)
+
+    if hybrid or prefilter:
+        return lexical_retrieval(collection,code_chunk,query_vector,n,hybrid,prefilter,timings,verbose,filters,windows=windows)
+    with timings.stage("search"):
+        return search(collection,query_vector,n,filters,windows)
+
+#[(id, squared l2 distance)] of the candidates closest first, the distance chroma reports for the collection. only the
+#candidates' vectors are read, so the dense stage costs as much as the prefilter lets through. windows are max pooled like in search
+def rank_candidates(collection,query_vector,candidate_ids,filters=None,windows=None):
+    import numpy as np
+    where = build_where(filters)
+    stored = collection.get(ids=candidate_ids, include=['embeddings'], **({"where": where} if where else {}))
+    if not len(stored['ids']):
+        return []
+    query_vector = np.asarray(query_vector, dtype=np.float32)
+    vectors = np.asarray(stored['embeddings'], dtype=np.float32)
+    distances = ((vectors - query_vector) ** 2).sum(axis=1)
+    if windows is not None:
+        window_hits = windows.get(where={"parent_id": {"$in": list(stored['ids'])}}, include=['embeddings','metadatas'])
+        if len(window_hits['ids']):
+            rows = {record_id: row for row, record_id in enumerate(stored['ids'])}
+            window_distances = ((np.asarray(window_hits['embeddings'], dtype=np.float32) - query_vector) ** 2).sum(axis=1)
+            for metadata, distance in zip(window_hits['metadatas'], window_distances):
+                row = rows[metadata['parent_id']]
+                distances[row] = min(distances[row], distance)
+    order = np.argsort(distances, kind='stable')
+    return [(stored['ids'][i], float(distances[i])) for i in order]
+
+#each id scores the sum of 1/(RRF_K + rank) over the rankings it shows up in
+def reciprocal_rank_fusion(rankings):
+    scores = {}
+    for ranking in rankings:
+        for rank, record_id in enumerate(ranking):
+            scores[record_id] = scores.get(record_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+#--hybrid fuses the dense and bm25 rankings with reciprocal rank fusion, --prefilter only lets the dense search rank the best
+#bm25 candidates instead of the whole collection. both together fuse the prefiltered dense ranking with bm25
+def lexical_retrieval(collection,code_chunk,query_vector,n,hybrid,prefilter,timings,verbose=False,filters=None,index=None,windows=None):
+    from lexical_index import LexicalIndex
+    with timings.stage("bm25"):
+        try:
+            lexical = (index or LexicalIndex()).search(clean_code(code_chunk), PREFILTER_SIZE if prefilter else FUSION_DEPTH)
+        except FileNotFoundError:
+            print("no lexical index, run vectorizer.py to build it. using the dense search only", file=sys.stderr)
+            lexical = None
+    if not lexical: #no index or not a single shared term
+        with timings.stage("search"):
+            return search(collection,query_vector,n,filters,windows)
+
+    with timings.stage("search"):
+        if prefilter:
+            dense = rank_candidates(collection, query_vector[0], [record_id for record_id, _ in lexical], filters, windows)
+        else:
+            results = search(collection, query_vector, FUSION_DEPTH, filters, windows)
+            dense = list(zip(results['ids'][0], results['distances'][0]))
+        where = build_where(filters)
+        if where: #bm25 knows nothing about metadata, chroma drops the candidates that dont pass
+            allowed = set(collection.get(ids=[record_id for record_id, _ in lexical], where=where, include=[])['ids'])
+            lexical = [(record_id, score) for record_id, score in lexical if record_id in allowed]
+    distances = dict(dense)
+
+    if hybrid:
+        ranked = reciprocal_rank_fusion([[record_id for record_id, _ in dense], [record_id for record_id, _ in lexical[:FUSION_DEPTH]]])
+    else:
+        ranked = dense
+
+    #a lexical index older than the collection can name records that were pruned since, those are skipped and the next
+    #ones in the ranking take their place
+    top = []
+    metadatas = {}
+    start = 0
+    while len(top) < n and start < len(ranked):
+        batch = ranked[start:start + n - len(top)]
+        start += len(batch)
+        stored = collection.get(ids=[record_id for record_id, _ in batch], include=['metadatas'])
+        metadatas.update(zip(stored['ids'], stored['metadatas'])) #get does not keep the order of ids
+        top.extend((record_id, score) for record_id, score in batch if record_id in metadatas)
+    top_ids = [record_id for record_id, _ in top]
+    if verbose:
+        print(f"bm25: {len(lexical)} candidates, dense: {len(dense)} ranked{' within the candidates' if prefilter else ''}", file=sys.stderr)
+    results = {
+        "ids": [top_ids],
+        "metadatas": [[metadatas[record_id] for record_id in top_ids]],
+        "distances": [[distances.get(record_id) for record_id in top_ids]] #None for ids only bm25 found
+    }
+    if hybrid:
+        results["scores"] = [[round(score, 6) for _, score in top]]
     return results
 
+#(tokenizer, model, device), loaded the first time a query vector is not in the embedding cache
+class LazyEncoder:
+    def __init__(self):
+        self.loaded = None
+
+    def get(self):
+        if self.loaded is None:
+            self.loaded = setup_enviornment()
+        return self.loaded
+
+#query vectors of several code chunks in order, cached ones from the embedding cache and the rest in one packed embed_texts call
+def embed_queries(code_chunks,cache,encoder,counts=None):
+    keys = [query_cache_key(code_chunk) for code_chunk in code_chunks]
+    query_vectors = [None if vector is None else vector.tolist() for vector in cache.get_many(keys)]
+    if counts is not None:
+        counts.add(query_vectors)
+    missing = [j for j, vector in enumerate(query_vectors) if vector is None]
+    if missing:
+        from encoder import embed_texts
+        tokenizer, model, device = encoder.get()
+        pooled, _ = embed_texts(tokenizer, model, device, [clean_code(code_chunks[j]) for j in missing], cache=cache)
+        for j, vector in zip(missing, pooled):
+            query_vectors[j] = vector
+        cache.put_many([keys[j] for j in missing], pooled)
+    return query_vectors
+
+#(name, body) of every function in the contract, None if the parser finds none
+def contract_functions(path_to_contract):
+    from contextlib import redirect_stdout
+    from parser import parse_solidity_functions
+    with redirect_stdout(sys.stderr): #the parser reports to stdout, which is our json
+        functions = parse_solidity_functions(path_to_contract)
+    bodies = [(name, "".join(body_lines)) for name, _, _, body_lines in functions.values()]
+    return [(name, body) for name, body in bodies if clean_code(body)] or None
+
+#per function hits fused into one ranked list. a template scores the sum of its similarities (1/(1+distance)) over all functions
+#that found it, so properties matching several functions of the contract rank above a single close hit. the same formal property
+#indexed from several records counts once. returns the QueryResult shape app.js reads, plus the score and best matching function
+def fuse_function_hits(results,function_names,n):
+    fused = {}
+    for name, ids, metadatas, distances in zip(function_names, results['ids'], results['metadatas'], results['distances']):
+        for record_id, metadata, distance in zip(ids, metadatas, distances):
+            key = (metadata or {}).get('formal_property') or record_id
+            entry = fused.setdefault(key, {"id": record_id, "metadata": metadata, "distance": distance, "function": name, "score": 0.0})
+            entry["score"] += 1.0 / (1.0 + distance)
+            if distance < entry["distance"]:
+                entry.update(id=record_id, metadata=metadata, distance=distance, function=name)
+    ranked = sorted(fused.values(), key=lambda entry: (-entry["score"], entry["distance"]))[:n]
+    return {
+        "ids": [[entry["id"] for entry in ranked]],
+        "metadatas": [[entry["metadata"] for entry in ranked]],
+        "distances": [[entry["distance"] for entry in ranked]],
+        "scores": [[round(entry["score"], 6) for entry in ranked]],
+        "matched_functions": [[entry["function"] for entry in ranked]]
+    }
+
+#--functions mode: every function of the contract is a query of its own, all of them embedded in one packed pass and searched
+#with one multi vector collection.query, then fused. contracts without parsable functions fall back to the whole contract query
+def function_level_retrieval(path_to_contract,code_chunk,n,timings=None,verbose=False,filters=None):
+    from embedding_cache import EmbeddingCache
+    timings = timings or StartupTimings()
+
+    with timings.stage("parse functions"):
+        functions = contract_functions(path_to_contract)
+    if functions is None:
+        return top_n_metadata_retrieval(code_chunk,n,timings,verbose,filters=filters)
+
+    with timings.stage("open collection"):
+        collection = open_collection()
+        windows = open_windows()
+    if collection is None:
+        return
+
+    cache = EmbeddingCache()
+    encoder = LazyEncoder()
+    counts = QueryCounts()
+    try:
+        with timings.stage("embed functions"):
+            query_vectors = embed_queries([body for _, body in functions], cache, encoder, counts)
+    finally:
+        cache.save()
+    if verbose:
+        print(f"{len(functions)} functions, {counts.report(cache)}{'' if encoder.loaded else ', model not loaded'}", file=sys.stderr)
+
+    with timings.stage("search"):
+        results = search(collection, query_vectors, max(n, FUNCTION_HITS), filters, windows)
+    with timings.stage("fuse"):
+        return fuse_function_hits(results, [name for name, _ in functions], n)
+
+#every .sol file under the given paths, directories are walked the same way parser.py --project walks a project
+def collect_contracts(paths):
+    contracts = []
+    for path in paths:
+        if not os.path.isdir(path):
+            contracts.append(path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.') and d != 'node_modules')
+            contracts.extend(os.path.join(dirpath, filename) for filename in sorted(filenames) if filename.endswith('.sol'))
+    return contracts
+
+#batch mode: the windows of every contract in a batch go through the model together (packed by length like the vectorizer)
+#and the batch is one multi embedding collection.query. one json line per contract is printed as soon as its batch is done,
+#so a whole repository costs one model load instead of one process per file. --hybrid and --prefilter load the bm25 index once
+#and rank every contract of the batch like a one shot query would
+def batch_retrieval(paths,n,batch_size=QUERY_BATCH,verbose=False,filters=None,hybrid=False,prefilter=False):
+    from embedding_cache import EmbeddingCache
+    collection = open_collection()
+    if collection is None:
+        return False
+    windows = open_windows()
+    index = None
+    if hybrid or prefilter:
+        from lexical_index import LexicalIndex
+        try:
+            index = LexicalIndex()
+        except FileNotFoundError:
+            print("no lexical index, run vectorizer.py to build it. using the dense search only", file=sys.stderr)
+            hybrid = prefilter = False
+    timings = StartupTimings()
+
+    started = time.perf_counter()
+    cache = EmbeddingCache()
+    encoder = LazyEncoder()
+    counts = QueryCounts()
+    answered = 0
+    try:
+        for i in range(0, len(paths), batch_size):
+            batch = []
+            for path in paths[i:i+batch_size]:
+                try:
+                    with open(path,'r',encoding='utf-8') as f:
+                        batch.append((path, f.read()))
+                except (OSError, UnicodeDecodeError) as e:
+                    print(json.dumps({"path": path, "error": str(e)}))
+            if not batch:
+                continue
+
+            query_vectors = embed_queries([code_chunk for _, code_chunk in batch], cache, encoder, counts)
+            if hybrid or prefilter:
+                per_contract = [lexical_retrieval(collection, code_chunk, [vector], n, hybrid, prefilter, timings, verbose, filters, index, windows) for (_, code_chunk), vector in zip(batch, query_vectors)]
+            else:
+                results = search(collection, query_vectors, n, filters, windows)
+                per_contract = [{field: [results[field][j]] for field in ('ids','metadatas','distances') if results.get(field) is not None} for j in range(len(batch))]
+            for (path, _), results in zip(batch, per_contract):
+                print(json.dumps({"path": path, **{field: values[0] for field, values in results.items()}}))
+            sys.stdout.flush()
+            answered += len(batch)
+    finally:
+        cache.save()
+
+    if verbose:
+        seconds = time.perf_counter() - started
+        print(f"batch: {answered}/{len(paths)} contracts in {seconds:.2f}s ({answered/max(seconds, 1e-9):.1f} contracts/s), {counts.report(cache)}", file=sys.stderr)
+    return True
+
+#latency of filtering inside chroma's search against the old way of over-fetching unfiltered neighbours and filtering them in python
+#(fetching 4x more until n pass or the collection runs out). also reports whether both found the same records
+def compare_filtering(collection,query_vector,n,filters,repeats=20):
+    total = collection.count()
+    started = time.perf_counter()
+    for _ in range(repeats):
+        results = search(collection, query_vector, n, filters)
+    where_ms = 1000 * (time.perf_counter() - started) / repeats
+    where_ids = results['ids'][0]
+
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fetch = min(4 * n, total)
+        while True:
+            results = search(collection, query_vector, fetch)
+            kept = [record_id for record_id, metadata in zip(results['ids'][0], results['metadatas'][0]) if matches_filters(metadata, filters)]
+            if len(kept) >= n or fetch >= total:
+                break
+            fetch = min(4 * fetch, total)
+    python_ms = 1000 * (time.perf_counter() - started) / repeats
+    python_ids = kept[:n]
+
+    print(f"filters {json.dumps(build_where(filters))} over {total} records, mean of {repeats} queries")
+    print(f"chroma where:          {where_ms:>8.2f} ms  {len(where_ids)} results")
+    print(f"over-fetch and filter: {python_ms:>8.2f} ms  {len(python_ids)} results, last fetch {fetch} neighbours")
+    print(f"same results: {'yes' if where_ids == python_ids else 'no'}")
+
+#ask a running rag_server.py, None when there is none (or it failed) so the caller does the one shot retrieval instead
+def query_server(code_chunk,n,filters=None):
+    import urllib.request
+    import urllib.error
+    request = urllib.request.Request(
+        f"http://{RAG_SERVER_HOST}:{RAG_SERVER_PORT}/query",
+        data=json.dumps({"code": code_chunk, "n": n, "filters": filters or {}}).encode('utf-8'),
+        headers={"Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=RAG_SERVER_TIMEOUT) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        print(f"rag server failed the query ({e.code}), retrieving without it", file=sys.stderr)
+        return None
+    except (urllib.error.URLError, OSError, ValueError):
+        return None
+
 if __name__ == '__main__':
-    code_chunk = read_contract(path_to_contract)
-    similar_ones = top_n_metadata_retrieval(code_chunk,3)
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="top n indexed properties for a contract, printed as json")
+    arg_parser.add_argument("paths", nargs="+", help="app.js calls this script with one contract path. more paths or a directory switch to batch mode")
+    arg_parser.add_argument("-n", type=int, default=3, help="properties retrieved per contract")
+    arg_parser.add_argument("--functions", action="store_true", help="query with every function of the contract and fuse the hits instead of one whole contract vector")
+    arg_parser.add_argument("--hybrid", action="store_true", help="fuse the dense results with bm25 over formal properties and identifiers (reciprocal rank fusion)")
+    arg_parser.add_argument("--prefilter", action="store_true", help=f"rank only the {PREFILTER_SIZE} best bm25 candidates with the dense search")
+    arg_parser.add_argument("--chunk-type", action="append", choices=["FUNCTION_RULE", "CONTRACT_INVARIANT"], help="only retrieve these record types (repeatable)")
+    arg_parser.add_argument("--rule-type", action="append", help="rule or invariant (repeatable)")
+    arg_parser.add_argument("--modifies-state", choices=["yes", "no"], help="only rules over functions that do (or dont) write state")
+    arg_parser.add_argument("--project", action="append", help="only records of these projects, a parser.py --project root name or a standalone pair's contract name (repeatable)")
+    arg_parser.add_argument("--rule-name", action="append", help="only these rules (repeatable)")
+    arg_parser.add_argument("--compare-filtering", action="store_true", help="time the filters as a chroma where clause against over-fetching and filtering in python")
+    arg_parser.add_argument("--batch", action="store_true", help="one json line per contract (ndjson) with the path, even for a single file")
+    arg_parser.add_argument("--batch-size", type=int, default=QUERY_BATCH, help="contracts per forward pass and collection.query in batch mode")
+    arg_parser.add_argument("--verbose", action="store_true", help="print embedding cache hits and misses to stderr")
+    arg_parser.add_argument("--timings", action="store_true", help="print where the time of this run went to stderr")
+    args = arg_parser.parse_args()
+    if args.functions and (args.hybrid or args.prefilter):
+        arg_parser.error("--functions fuses per function dense hits, it cant be combined with --hybrid or --prefilter")
+    filters = {field: values for field, values in (
+        ("chunk_type", args.chunk_type),
+        ("rule_type", args.rule_type),
+        ("modifies_state", None if args.modifies_state is None else [args.modifies_state == "yes"]),
+        ("project", args.project),
+        ("rule_name", args.rule_name)
+    ) if values}
+
+    if args.compare_filtering:
+        from embedding_cache import EmbeddingCache
+        collection = open_collection()
+        if collection is None:
+            sys.exit(1)
+        cache = EmbeddingCache()
+        query_vector = embed_queries([read_contract(args.paths[0])], cache, LazyEncoder())
+        cache.save()
+        compare_filtering(collection, query_vector, args.n, filters)
+        sys.exit(0)
+
+    if args.batch or len(args.paths) > 1 or os.path.isdir(args.paths[0]):
+        succeeded = batch_retrieval(collect_contracts(args.paths), args.n, args.batch_size, args.verbose, filters, args.hybrid, args.prefilter)
+        sys.stdout.flush()
+        sys.exit(0 if succeeded else 1)
+
+    timings = StartupTimings()
+    code_chunk = read_contract(args.paths[0])
+    with timings.stage("rag server"):
+        similar_ones = query_server(code_chunk,args.n,filters) if os.environ.get("SCRIA_RAG_SERVER", "1") != "0" and not (args.functions or args.hybrid or args.prefilter) else None
+    if similar_ones is None and args.functions:
+        similar_ones = function_level_retrieval(args.paths[0],code_chunk,args.n,timings,args.verbose,filters)
+    elif similar_ones is None:
+        similar_ones = top_n_metadata_retrieval(code_chunk,args.n,timings,args.verbose,args.hybrid,args.prefilter,filters)
     if similar_ones:
         print(json.dumps(similar_ones))
     else:
         print(json.dumps({"error": "Retrieval failed or returned empty result."}), file=sys.stderr)
+    if args.timings:
+        timings.report()
 
     sys.stdout.flush()
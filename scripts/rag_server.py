@@ -0,0 +1,133 @@
+#resident retrieval server. keeps codebert and the chroma collection loaded so a query from app.js (through rag_agent.py) costs
+#one forward pass instead of importing torch and loading the model every time. localhost http only:
+#  POST /query  {"code": "<solidity source>", "n": 3, "filters": {"chunk_type": ["FUNCTION_RULE"]}} -> same json rag_agent.py prints
+#  GET  /health -> encoder and collection size once ready
+#  GET  /stats  -> queries served, latency and embedding cache hits
+#run it from the repo root like the other scripts: python scripts/rag_server.py
+
+import os
+import sys
+import json
+import time
+import signal
+import threading
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from embedding_cache import EmbeddingCache
+from encoder import load_encoder, encoder_id, BACKENDS, DEFAULT_BACKEND
+from vector_store import STORES, default_store
+from rag_agent import open_collection, open_windows, generate_query_vector, search, build_where, RAG_SERVER_HOST, RAG_SERVER_PORT
+
+MAX_REQUEST_BYTES = 8 * 1024 * 1024 #a contract is far below this, anything bigger is not a query
+
+class RetrievalService:
+    def __init__(self, backend=DEFAULT_BACKEND, store=None):
+        self.collection = open_collection(store)
+        if self.collection is None:
+            sys.exit(1)
+        self.windows = open_windows(store)
+        self.tokenizer, self.model, self.device = load_encoder(backend)
+        self.cache = EmbeddingCache()
+        self.lock = threading.Lock() #one query in the model at a time, the cache is not thread safe either
+        self.started = time.time()
+        self.queries = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def query(self, code_chunk, n, filters=None):
+        started = time.perf_counter()
+        with self.lock:
+            query_vector = generate_query_vector(self.tokenizer, self.model, self.device, code_chunk, self.cache)
+            if self.cache.dirty and self.cache.misses: #a new vector, keep it if the server gets killed
+                self.cache.save()
+        results = search(self.collection, query_vector, n, filters, self.windows)
+        with self.lock:
+            self.queries += 1
+            self.seconds += time.perf_counter() - started
+        return results
+
+    def health(self):
+        return {"status": "ok", "encoder": encoder_id(self.model), "records": self.collection.count()}
+
+    def stats(self):
+        with self.lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started, 1),
+                "queries": self.queries,
+                "errors": self.errors,
+                "mean_latency_ms": round(1000 * self.seconds / self.queries, 1) if self.queries else None,
+                "cache_hits": self.cache.hits,
+                "cache_misses": self.cache.misses,
+                "cache_entries": len(self.cache)
+            }
+
+class RequestHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, self.server.service.health())
+        elif self.path == "/stats":
+            self.send_json(200, self.server.service.stats())
+        else:
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/query":
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_REQUEST_BYTES:
+            self.send_json(400, {"error": "expected a json body"})
+            return
+        try:
+            request = json.loads(self.rfile.read(length))
+            code_chunk = request["code"]
+            n = int(request.get("n", 3))
+            filters = request.get("filters") or {}
+            build_where(filters) #unknown fields or wrong types are the client's fault
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {"error": f"bad query; {e}"})
+            return
+        service = self.server.service
+        try:
+            self.send_json(200, service.query(code_chunk, n, filters))
+        except Exception as e:
+            with service.lock:
+                service.errors += 1
+            print(f"query failed; {e}", file=sys.stderr)
+            self.send_json(500, {"error": str(e)})
+
+    def log_message(self, format, *args): #stderr per request is noise, /stats has the numbers
+        pass
+
+def serve(host=RAG_SERVER_HOST, port=RAG_SERVER_PORT, backend=DEFAULT_BACKEND, store=None):
+    service = RetrievalService(backend, store)
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.service = service
+    print(f"rag server on http://{host}:{port} ({encoder_id(service.model)}, {service.collection.count()} records)", file=sys.stderr)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0)) #same clean shutdown as ctrl+c, the cache gets saved
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        with service.lock:
+            service.cache.save()
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="keep codebert and the knowledge base loaded and answer rag_agent.py queries")
+    arg_parser.add_argument("--host", default=RAG_SERVER_HOST, help="keep it on localhost, there is no auth")
+    arg_parser.add_argument("--port", type=int, default=RAG_SERVER_PORT, help="rag_agent.py reads SCRIA_RAG_PORT to find a non default port")
+    arg_parser.add_argument("--backend", choices=BACKENDS, default=DEFAULT_BACKEND)
+    arg_parser.add_argument("--store", choices=STORES, default=default_store(), help="chroma or the in memory exact search numpy store")
+    args = arg_parser.parse_args()
+    serve(args.host, args.port, args.backend, args.store)
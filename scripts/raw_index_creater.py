@@ -1,57 +1,100 @@
 import os
 import sys
-import json
-import subprocess
+import argparse
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from parser import parse_pair, write_index, index_output_path, OUTPUT_DIR
+from manifest import Manifest, sha256_file, sha256_text, report
 
 #config
 PATH_TO_FOLDER = "ContractsAndProperties"
-PARSER_SCRIPT = "parser.py"
 
-def create_raw_indices():
+#pair every .sol with the .spec of same base name, returns (pairs, skipped base names with the missing ext)
+def collect_pairs(folder):
     file_groups = defaultdict(dict)
-    if not os.path.isdir(PATH_TO_FOLDER):
-        print("ContractAndProperties folder cannot be found")
-        sys.exit(1)
-    for filename in os.listdir(PATH_TO_FOLDER): #creating a dict of all files in ContractsAndProperties
+    for filename in os.listdir(folder): #creating a dict of all files in ContractsAndProperties
         base_name, ext = os.path.splitext(filename)
         if ext in ['.sol','.spec']:
             file_groups[base_name][ext]=filename
-    
-    processed_count = 0 #count for total files succesfully parsed
-    total_count = len(file_groups)
 
-    for base_name, files in file_groups.items(): #running parser for each pair of .sol and .spec
+    pairs = []
+    skipped = []
+    for base_name, files in sorted(file_groups.items()):
         sol_file = files.get('.sol')
         spec_file = files.get('.spec')
         if sol_file and spec_file:
-            sol_path = os.path.join(PATH_TO_FOLDER,sol_file)
-            spec_path = os.path.join(PATH_TO_FOLDER,spec_file)
-            command = ['python','scripts/'+PARSER_SCRIPT,sol_path,spec_path]
+            pairs.append((base_name, os.path.join(folder,sol_file), os.path.join(folder,spec_file)))
+        else:
+            skipped.append((base_name, '.spec' if sol_file else '.sol'))
+    return pairs, skipped
 
+#parse all pairs over a process pool (parser is imported once per worker, not once per pair), index files are written by this process as results come in
+def create_raw_indices_batch(pairs, workers=None, output_dir=OUTPUT_DIR):
+    processed = []
+    failures = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(parse_pair, sol_path, spec_path): (base_name, sol_path) for base_name, sol_path, spec_path in pairs}
+        for future in as_completed(futures):
+            base_name, sol_path = futures[future]
             try:
-                result = subprocess.run(
-                    command,
-                    capture_output=True,
-                    text = True,
-                    check= True
-                )
-                print(f"success: {result.stdout.strip()}")
-                processed_count+=1
-            
-            except subprocess.CalledProcessError as e:
-                print(f"parser failed for {base_name}.",file=sys.stderr)
-                print(e)
+                records = future.result()
+                output_path = index_output_path(sol_path, output_dir)
+                write_index(records, output_path)
             except Exception as e:
-                print(f"error occured")
-                print(e)
-                sys.exit(1)
-            
-        else:
-            missing_file = '.spec' if sol_file else '.sol'
-            print(f"skipping {base_name}, missing {missing_file} file", file=sys.stderr)
+                print(f"parser failed for {base_name}: {e}", file=sys.stderr)
+                failures.append((base_name, str(e)))
+                continue
+            print(f"success: {base_name} -> {output_path} ({len(records)} records)")
+            processed.append((base_name, output_path))
+
+    return processed, failures
+
+#combined content hash of a pair, changes if either the .sol or the .spec changes
+def pair_digest(sol_path, spec_path):
+    return sha256_text(sha256_file(sol_path) + sha256_file(spec_path))
+
+def create_raw_indices(folder=PATH_TO_FOLDER, workers=None, force=False):
+    if not os.path.isdir(folder):
+        print("ContractAndProperties folder cannot be found")
+        sys.exit(1)
+
+    pairs, skipped = collect_pairs(folder)
+    for base_name, missing_file in skipped:
+        print(f"skipping {base_name}, missing {missing_file} file", file=sys.stderr)
+
+    #only reparse pairs whose inputs changed since the last run, or whose index file went missing
+    manifest = Manifest()
+    digests = {}
+    pending = []
+    for base_name, sol_path, spec_path in pairs:
+        digest = pair_digest(sol_path, spec_path)
+        if not force and manifest.is_fresh('parser', sol_path, digest) and os.path.exists(index_output_path(sol_path)):
+            continue
+        digests[base_name] = (sol_path, spec_path, digest)
+        pending.append((base_name, sol_path, spec_path))
+
+    processed, failures = create_raw_indices_batch(pending, workers)
+
+    for base_name, output_path in processed:
+        sol_path, spec_path, digest = digests[base_name]
+        manifest.record('parser', sol_path, digest, spec=spec_path, output=output_path)
+    manifest.save()
 
-    print(f"total pairs processed:{processed_count} out of {total_count}")
+    total_count = len(pairs) + len(skipped)
+    print(f"total pairs processed:{len(processed)} out of {total_count}")
+    report('parser', len(processed), len(pairs) - len(pending))
+    if failures:
+        print(f"{len(failures)} pairs failed:", file=sys.stderr)
+        for base_name, error in failures:
+            print(f"  {base_name}: {error}", file=sys.stderr)
+    return processed, failures
 
 if __name__ == '__main__':
-    create_raw_indices()
+    arg_parser = argparse.ArgumentParser(description="parse every .sol/.spec pair in a folder into DataIndex/raw_index")
+    arg_parser.add_argument("--folder", default=PATH_TO_FOLDER)
+    arg_parser.add_argument("--workers", type=int, default=None, help="parser processes, defaults to cpu count")
+    arg_parser.add_argument("--force", action="store_true", help="reparse every pair even if the manifest says it is unchanged")
+    args = arg_parser.parse_args()
+    create_raw_indices(args.folder, args.workers, args.force)
@@ -0,0 +1,188 @@
+import os
+import re
+from bisect import bisect_right
+from collections import defaultdict
+from functools import lru_cache
+
+from lexer import SourceScan
+
+CONTRACT_PATTERN = re.compile(r"\b(contract|interface|library)\s+(\w+)")
+FUNCTION_PATTERN = re.compile(r"\bfunction\s+(\w+)")
+SPECIAL_FUNCTION_PATTERN = re.compile(r"\b(constructor|fallback|receive)\s*\(")
+MODIFIER_PATTERN = re.compile(r"\bmodifier\s+(\w+)")
+BASES_PATTERN = re.compile(r"\bis\b([\s\S]*)")
+BASE_NAME_PATTERN = re.compile(r"[\w.]+")
+IMPORT_PATTERN = re.compile(r"\bimport\b")
+IMPORT_PATH_PATTERN = re.compile(r"[\"']([^\"']+)[\"']")
+STATE_VAR_PATTERNS = [
+    re.compile(r'(?:public|private|internal|external)\s+(\w+)\s*;'),
+    re.compile(r'(?:uint|int|bool|address|string|bytes)\d*\s+(?:public|private|internal)?\s*(\w+)\s*;'),
+    re.compile(r'mapping\s*\([^)]+\)\s+(?:public|private|internal)?\s*(\w+)\s*;')
+]
+
+#split "A, B(1, 2), C" on the commas that are not inside parentheses
+def split_top_level(text):
+    parts = []
+    depth = 0
+    last = 0
+    for i, char in enumerate(text):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            parts.append(text[last:i])
+            last = i+1
+    parts.append(text[last:])
+    return [part.strip() for part in parts if part.strip()]
+
+#import paths of a scanned source (solidity or cvl), as written. the path string itself is masked so it is read back from the original code
+#the path is the first string after the keyword, as long as the statement did not end before it (cvl imports have no ';')
+def find_imports(scan):
+    imports = []
+    for match in IMPORT_PATTERN.finditer(scan.masked):
+        path_match = IMPORT_PATH_PATTERN.search(scan.code, match.end())
+        if path_match and ";" not in scan.masked[match.end() : path_match.start()]:
+            imports.append(path_match.group(1))
+    return imports
+
+#everything a .sol file declares, indexed once with offsets into the source so every lookup afterwards is a dict access
+#contracts: name -> entry, functions/modifiers: name -> [entries] (overloads in file order), state_variables: contract -> [names]
+class SymbolTable:
+    def __init__(self, code, path=None):
+        self.path = path
+        self.scan = SourceScan(code)
+        self.code = code
+        self.contracts = {}
+        self.functions = defaultdict(list)
+        self.function_list = [] #every function in file order, overloads included
+        self.modifiers = defaultdict(list)
+        self.state_variables = {}
+        self.imports = find_imports(self.scan)
+        self._contract_starts = []
+        self._contract_order = []
+
+        self._index_contracts()
+        self._index_members()
+        self._index_state_variables()
+
+    def _index_contracts(self):
+        masked = self.scan.masked
+        for match in CONTRACT_PATTERN.finditer(masked):
+            body_start, end = self.scan.body_span(match.end())
+            if body_start is None:
+                continue
+            bases = []
+            bases_match = BASES_PATTERN.search(masked, match.end(), body_start)
+            if bases_match:
+                for base in split_top_level(bases_match.group(1)):
+                    base_name = BASE_NAME_PATTERN.match(base)
+                    if base_name:
+                        bases.append(base_name.group())
+            name = match.group(2)
+            entry = {
+                "name": name,
+                "kind": match.group(1),
+                "start": match.start(),
+                "body_start": body_start,
+                "end": end,
+                "bases": bases
+            }
+            self.contracts.setdefault(name, entry)
+            self._contract_starts.append(body_start)
+            self._contract_order.append(entry)
+
+    #contract whose body contains offset, None for file level
+    def contract_at(self, offset):
+        i = bisect_right(self._contract_starts, offset)-1
+        if i >= 0 and offset <= self._contract_order[i]["end"]:
+            return self._contract_order[i]["name"]
+        return None
+
+    def _member(self, kind, name, match):
+        body_start, end = self.scan.body_span(match.end())
+        return {
+            "name": name,
+            "kind": kind,
+            "contract": self.contract_at(match.start()),
+            "start": match.start(),
+            "body_start": body_start,
+            "end": end
+        }
+
+    def _index_members(self):
+        masked = self.scan.masked
+        for match in FUNCTION_PATTERN.finditer(masked):
+            entry = self._member("function", match.group(1), match)
+            self.functions[entry["name"]].append(entry)
+            self.function_list.append(entry)
+        for match in SPECIAL_FUNCTION_PATTERN.finditer(masked):
+            entry = self._member(match.group(1), match.group(1), match)
+            self.functions[entry["name"]].append(entry)
+        for match in MODIFIER_PATTERN.finditer(masked):
+            entry = self._member("modifier", match.group(1), match)
+            self.modifiers[entry["name"]].append(entry)
+
+    #state vars are declarations at contract level, so function bodies and other nested blocks are cut out before matching
+    def _index_state_variables(self):
+        masked = self.scan.masked
+        for entry in self._contract_order:
+            parts = []
+            position = entry["body_start"]+1
+            while True:
+                brace = masked.find("{", position, entry["end"])
+                if brace == -1:
+                    parts.append(masked[position:entry["end"]])
+                    break
+                parts.append(masked[position:brace])
+                position = self.scan.brace_match.get(brace, entry["end"])+1
+            contract_level = "".join(parts)
+            names = self.state_variables.setdefault(entry["name"], [])
+            for pattern in STATE_VAR_PATTERNS:
+                for name in pattern.findall(contract_level):
+                    if name not in names:
+                        names.append(name)
+
+    def all_state_variables(self):
+        return {name for names in self.state_variables.values() for name in names}
+
+    #source text of a contract/function/modifier entry, from its keyword to the closing brace (or ';')
+    def source(self, entry):
+        return self.code[entry["start"] : entry["end"]+1]
+
+    def body(self, entry):
+        if entry["body_start"] is None:
+            return ""
+        return self.code[entry["body_start"]+1 : entry["end"]]
+
+    def lines(self, entry):
+        start_line = self.scan.line_of(entry["start"])
+        end_line = self.scan.line_of(entry["end"])
+        return start_line, end_line, self.scan.lines[start_line-1 : end_line]
+
+    #first function (or constructor/fallback/receive) with that name, optionally only inside one contract
+    def find_function(self, name, contract=None):
+        for entry in self.functions.get(name, ()):
+            if contract is None or entry["contract"] == contract:
+                return entry
+        return None
+
+    def find_modifier(self, name, contract=None):
+        for entry in self.modifiers.get(name, ()):
+            if contract is None or entry["contract"] == contract:
+                return entry
+        return None
+
+    def modifiers_of(self, contract=None):
+        return [entry for entries in self.modifiers.values() for entry in entries if contract is None or entry["contract"] == contract]
+
+@lru_cache(maxsize=256)
+def _load_symbol_table(path, mtime_ns, size):
+    with open(path, "r", encoding="utf-8") as f:
+        return SymbolTable(f.read(), path)
+
+#memoized by path+mtime, every caller asking for the same unchanged file shares one table
+def load_symbol_table(path):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return _load_symbol_table(path, stat.st_mtime_ns, stat.st_size)
@@ -0,0 +1,301 @@
+#vector stores the vectorizer writes to and rag_agent searches. both expose the part of the chroma collection api this repo uses
+#(upsert, delete, get, query, count) plus save, so the callers dont care which one they have:
+#  chroma - the persistent chroma collection, approximate (hnsw) search
+#  numpy  - a float32 matrix saved to disk and memory mapped, exact search with one matmul and argpartition per query batch
+#the corpus is a few tens of thousands of 768 dim vectors, which is ~100MB as a matrix, so brute force is cheap
+
+import os
+import sys
+import json
+import time
+import argparse
+from functools import lru_cache
+
+import numpy as np
+
+PATH_TO_CHROMA_DB = os.path.join(os.getcwd(), 'DataIndex', 'chroma_db')
+PATH_TO_NUMPY_STORE = os.path.join(os.getcwd(), 'DataIndex', 'numpy_store')
+STORES = ("chroma", "numpy")
+KNOWLEDGE_BASE = "scria_knowledge_base"
+WINDOWS_COLLECTION = "scria_knowledge_windows" #per window vectors of records longer than one window
+EXPORT_PAGE = 4096 #records copied per get when exporting chroma to the numpy store
+QUERY_CHUNK = 256 #queries per matmul, bounds the distance matrix at QUERY_CHUNK x records
+
+#rag_agent is started by app.js without flags, the env var picks its store like SCRIA_ENCODER picks the encoder
+def default_store():
+    return os.environ.get("SCRIA_VECTOR_STORE", "chroma")
+
+#the where clauses rag_agent builds ($eq, $in, $and) plus $ne, $nin and $or, evaluated against one metadata dict
+def where_matches(metadata, where):
+    if not where:
+        return True
+    if "$and" in where:
+        return all(where_matches(metadata, condition) for condition in where["$and"])
+    if "$or" in where:
+        return any(where_matches(metadata, condition) for condition in where["$or"])
+    for field, condition in where.items():
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, value in condition.items():
+            actual = (metadata or {}).get(field)
+            if operator == "$eq":
+                matched = actual == value
+            elif operator == "$ne":
+                matched = actual != value
+            elif operator == "$in":
+                matched = actual in value
+            elif operator == "$nin":
+                matched = actual not in value
+            else:
+                raise ValueError(f"where operator {operator} is not supported by the numpy store")
+            if not matched:
+                return False
+    return True
+
+#$in/$nin lists as sets, a where clause is checked against every row so membership should not scan a list
+def compile_where(where):
+    if not where:
+        return where
+    if "$and" in where or "$or" in where:
+        return {operator: [compile_where(condition) for condition in conditions] for operator, conditions in where.items()}
+    return {field: {operator: frozenset(value) if operator in ("$in", "$nin") else value for operator, value in condition.items()} if isinstance(condition, dict) else condition
+            for field, condition in where.items()}
+
+#one persistent client per database path for the whole process, the knowledge base and the windows collection share it
+@lru_cache(maxsize=None)
+def chroma_client(path=PATH_TO_CHROMA_DB):
+    import chromadb
+    return chromadb.PersistentClient(path=path)
+
+class ChromaStore:
+    def __init__(self, name, path=PATH_TO_CHROMA_DB, create=False):
+        client = chroma_client(path)
+        self.collection = client.get_or_create_collection(name=name) if create else client.get_collection(name)
+
+    def upsert(self, ids, embeddings, metadatas=None, documents=None):
+        self.collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+
+    def delete(self, ids=None, where=None):
+        self.collection.delete(ids=ids, where=where)
+
+    def get(self, ids=None, where=None, include=("metadatas",), limit=None, offset=None):
+        return self.collection.get(ids=ids, where=where, include=list(include), limit=limit, offset=offset)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=("metadatas", "distances")):
+        return self.collection.query(query_embeddings=query_embeddings, n_results=n_results, include=list(include), **({"where": where} if where else {}))
+
+    def count(self):
+        return self.collection.count()
+
+    def save(self): #chroma persists every write itself
+        pass
+
+#one directory per collection: vectors.f32 (rows of float32) and records.json (ids, metadatas and documents in row order).
+#reads memory map the matrix. writes are buffered and applied on the next read or save, save rewrites both files and swaps them in
+class NumpyStore:
+    def __init__(self, name, path=PATH_TO_NUMPY_STORE, create=False):
+        self.path = os.path.join(path, name)
+        self.vectors_path = os.path.join(self.path, 'vectors.f32')
+        self.records_path = os.path.join(self.path, 'records.json')
+        self.pending = {} #id -> (vector, metadata, document) upserted since the last apply
+        self.deleted = set()
+        self.dirty = False
+        if not os.path.exists(self.records_path):
+            if not create:
+                raise FileNotFoundError(f"no numpy store at {self.path}, run vectorizer.py --store numpy or vector_store.py --export-numpy")
+            os.makedirs(self.path, exist_ok=True)
+            self.dim = None
+            self.ids, self.metadatas, self.documents = [], [], []
+            self.vectors = np.zeros((0, 0), dtype=np.float32)
+        else:
+            with open(self.records_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+            self.dim = records['dim']
+            self.ids, self.metadatas, self.documents = records['ids'], records['metadatas'], records['documents']
+            if os.path.getsize(self.vectors_path) != len(self.ids) * self.dim * 4:
+                raise ValueError(f"{self.vectors_path} does not match {self.records_path}, rebuild the numpy store")
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(len(self.ids), self.dim)) if self.ids else np.zeros((0, self.dim), dtype=np.float32)
+        self.rows = {record_id: row for row, record_id in enumerate(self.ids)}
+        self.norms = (np.asarray(self.vectors) ** 2).sum(axis=1) #squared row norms, distance = |q|^2 + |x|^2 - 2 q.x
+
+    def upsert(self, ids, embeddings, metadatas=None, documents=None):
+        metadatas = metadatas or [{} for _ in ids]
+        documents = documents or [None for _ in ids]
+        for record_id, vector, metadata, document in zip(ids, embeddings, metadatas, documents):
+            self.pending[record_id] = (vector, metadata, document)
+            self.deleted.discard(record_id)
+        self.dirty = True
+
+    def delete(self, ids=None, where=None):
+        self._apply()
+        if ids is not None:
+            self.deleted.update(record_id for record_id in ids if record_id in self.rows)
+        if where is not None:
+            where = compile_where(where)
+            self.deleted.update(record_id for record_id, metadata in zip(self.ids, self.metadatas) if where_matches(metadata, where))
+        self.dirty = self.dirty or bool(self.deleted)
+
+    #folds pending upserts and deletes into the in memory matrix, the files on disk only change on save
+    def _apply(self):
+        if not self.pending and not self.deleted:
+            return
+        keep = [row for row, record_id in enumerate(self.ids) if record_id not in self.deleted and record_id not in self.pending]
+        new_ids = list(self.pending)
+        if new_ids:
+            new_vectors = np.asarray([self.pending[record_id][0] for record_id in new_ids], dtype=np.float32)
+            if self.dim is None:
+                self.dim = new_vectors.shape[1]
+            if new_vectors.shape[1] != self.dim:
+                raise ValueError(f"vectors of {new_vectors.shape[1]} dims do not fit a store of {self.dim} dims")
+        else:
+            new_vectors = np.zeros((0, self.dim or 0), dtype=np.float32)
+        self.vectors = np.concatenate([np.asarray(self.vectors[keep], dtype=np.float32).reshape(len(keep), self.dim or 0), new_vectors])
+        self.ids = [self.ids[row] for row in keep] + new_ids
+        self.metadatas = [self.metadatas[row] for row in keep] + [self.pending[record_id][1] for record_id in new_ids]
+        self.documents = [self.documents[row] for row in keep] + [self.pending[record_id][2] for record_id in new_ids]
+        self.rows = {record_id: row for row, record_id in enumerate(self.ids)}
+        self.norms = (self.vectors ** 2).sum(axis=1)
+        self.pending = {}
+        self.deleted = set()
+
+    def _select(self, rows, include):
+        result = {"ids": [self.ids[row] for row in rows]}
+        result["metadatas"] = [self.metadatas[row] for row in rows] if "metadatas" in include else None
+        result["documents"] = [self.documents[row] for row in rows] if "documents" in include else None
+        result["embeddings"] = [np.asarray(self.vectors[row]).tolist() for row in rows] if "embeddings" in include else None
+        return result
+
+    #rows passing where, None means all of them
+    def _filter(self, where):
+        if not where:
+            return None
+        where = compile_where(where)
+        return np.asarray([row for row, metadata in enumerate(self.metadatas) if where_matches(metadata, where)], dtype=np.int64)
+
+    def get(self, ids=None, where=None, include=("metadatas",), limit=None, offset=None):
+        self._apply()
+        rows = range(len(self.ids)) if ids is None else [self.rows[record_id] for record_id in ids if record_id in self.rows]
+        if where:
+            where = compile_where(where)
+            rows = [row for row in rows if where_matches(self.metadatas[row], where)]
+        rows = list(rows)[offset or 0:]
+        return self._select(rows[:limit] if limit is not None else rows, include)
+
+    #exact squared l2 neighbours (what chroma reports by default) of every query, nearest first
+    def query(self, query_embeddings, n_results=10, where=None, include=("metadatas", "distances")):
+        self._apply()
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        candidates = self._filter(where)
+        matrix = self.vectors if candidates is None else self.vectors[candidates]
+        norms = self.norms if candidates is None else self.norms[candidates]
+        k = min(n_results, len(norms))
+        result = {"ids": [], "metadatas": [] if "metadatas" in include else None, "distances": [] if "distances" in include else None,
+                  "documents": [] if "documents" in include else None, "embeddings": None}
+        for start in range(0, len(queries), QUERY_CHUNK):
+            chunk = queries[start:start+QUERY_CHUNK]
+            if k == 0:
+                for field in ("ids", "metadatas", "distances", "documents"):
+                    if result[field] is not None:
+                        result[field].extend([] for _ in chunk)
+                continue
+            distances = (chunk ** 2).sum(axis=1)[:, None] + norms[None, :] - 2.0 * (chunk @ matrix.T)
+            np.maximum(distances, 0.0, out=distances) #rounding can push an exact match slightly below zero
+            nearest = np.argpartition(distances, k-1, axis=1)[:, :k] if k < len(norms) else np.tile(np.arange(len(norms)), (len(chunk), 1))
+            for q, columns in enumerate(nearest):
+                columns = columns[np.argsort(distances[q, columns], kind='stable')]
+                rows = columns if candidates is None else candidates[columns]
+                selected = self._select(rows, include)
+                result["ids"].append(selected["ids"])
+                for field in ("metadatas", "documents"):
+                    if result[field] is not None:
+                        result[field].append(selected[field])
+                if result["distances"] is not None:
+                    result["distances"].append(distances[q, columns].tolist())
+        return result
+
+    def count(self):
+        self._apply()
+        return len(self.ids)
+
+    def save(self):
+        self._apply()
+        if not self.dirty:
+            return
+        matrix = np.ascontiguousarray(self.vectors, dtype=np.float32)
+        with open(self.vectors_path + '.tmp', 'wb') as f:
+            matrix.tofile(f)
+        with open(self.records_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({"dim": self.dim or 0, "ids": self.ids, "metadatas": self.metadatas, "documents": self.documents}, f, separators=(',', ':'))
+        self.vectors = matrix #drop the memmap of the old file before it is replaced
+        os.replace(self.vectors_path + '.tmp', self.vectors_path)
+        os.replace(self.records_path + '.tmp', self.records_path) #records.json is swapped last, a crash in between fails the size check
+        self.dirty = False
+
+def open_store(name, backend=None, create=False):
+    backend = backend or default_store()
+    if backend == "chroma":
+        return ChromaStore(name, create=create)
+    if backend == "numpy":
+        return NumpyStore(name, create=create)
+    raise ValueError(f"unknown vector store {backend}, expected one of {', '.join(STORES)}")
+
+#copy a chroma collection into the numpy store page by page, no re-embedding needed
+def export_numpy(name=KNOWLEDGE_BASE):
+    source = ChromaStore(name)
+    target = NumpyStore(name, create=True)
+    target.delete(ids=list(target.rows))
+    offset = 0
+    while True:
+        page = source.get(include=("embeddings", "metadatas", "documents"), limit=EXPORT_PAGE, offset=offset)
+        if len(page['ids']):
+            target.upsert(page['ids'], page['embeddings'], page['metadatas'], page.get('documents'))
+        if len(page['ids']) < EXPORT_PAGE:
+            break
+        offset += EXPORT_PAGE
+    target.save()
+    print(f"exported {target.count()} records of {name} to {target.path}")
+
+def timed_queries(store, queries, k, batch_size):
+    neighbours = []
+    started = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        neighbours.extend(store.query(queries[i:i+batch_size], n_results=k, include=())['ids'])
+    return neighbours, time.perf_counter() - started
+
+#stored vectors of a sample of records, slightly perturbed so a query is not just its own record, go through both stores one at
+#a time and in batches. recall@k of chroma is measured against the exact numpy neighbours
+def benchmark(name=KNOWLEDGE_BASE, sample_size=200, k=10, batch_size=32, seed=0):
+    chroma = ChromaStore(name)
+    numpy_store = NumpyStore(name)
+    if numpy_store.count() != chroma.count():
+        print(f"numpy store has {numpy_store.count()} records, chroma {chroma.count()}. run --export-numpy first for a fair comparison", file=sys.stderr)
+
+    random = np.random.default_rng(seed)
+    rows = random.choice(numpy_store.count(), size=min(sample_size, numpy_store.count()), replace=False)
+    sample = np.asarray(numpy_store.vectors[np.sort(rows)], dtype=np.float32)
+    queries = (sample + random.normal(scale=0.01 * np.abs(sample).mean(), size=sample.shape).astype(np.float32)).tolist()
+
+    print(f"{len(queries)} queries, k={k}, {numpy_store.count()} records")
+    print("store   batch  ms/query  queries/s  recall@k")
+    exact = None
+    for label, store in (("numpy", numpy_store), ("chroma", chroma)):
+        for size in (1, batch_size):
+            neighbours, seconds = timed_queries(store, queries, k, size)
+            exact = exact or neighbours
+            recall = np.mean([len(set(found) & set(expected)) / max(len(expected), 1) for found, expected in zip(neighbours, exact)])
+            print(f"{label:<6}  {size:>5}  {1000*seconds/len(queries):>8.3f}  {len(queries)/max(seconds, 1e-9):>9.1f}  {recall:>8.3f}")
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="vector store backends of the knowledge base")
+    arg_parser.add_argument("--export-numpy", action="store_true", help=f"copy the chroma collections to {PATH_TO_NUMPY_STORE}")
+    arg_parser.add_argument("--benchmark", action="store_true", help="latency and recall@k of chroma against exact numpy search")
+    arg_parser.add_argument("--sample", type=int, default=200)
+    arg_parser.add_argument("-k", type=int, default=10)
+    arg_parser.add_argument("--batch-size", type=int, default=32)
+    args = arg_parser.parse_args()
+
+    if args.export_numpy:
+        export_numpy(KNOWLEDGE_BASE)
+        export_numpy(WINDOWS_COLLECTION)
+    if args.benchmark:
+        benchmark(sample_size=args.sample, k=args.k, batch_size=args.batch_size)
@@ -1,40 +1,50 @@
 #this script is our AI Engine builder 
 
 import torch
-from transformers import AutoTokenizer, AutoModel
 import sys
 import os
-import chromadb
 import json
 import re
+import copy
+import time
+import queue
+import threading
+import traceback
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
-MODEL_NAME = "microsoft/codebert-base"
-PATH_TO_MASTER_INDEX = os.path.join(os.getcwd(), 'DataIndex','master_index.json')
-PATH_TO_CHROMA_DB = os.path.join(os.getcwd(), 'DataIndex', 'chroma_db')
-BATCH_SIZE = 32
+from manifest import Manifest, sha256_text, report
+from master_index import MasterIndex, PATH_TO_MASTER_INDEX
+from embedding_cache import EmbeddingCache, cache_key
+import lexical_index
+from vector_store import open_store, default_store, STORES, KNOWLEDGE_BASE, WINDOWS_COLLECTION, PATH_TO_CHROMA_DB
+from encoder import load_encoder, encoder_id, embed_texts, tokenize_windows, Throughput, POOLING, BATCH_SIZE, TOKENS_PER_BATCH, BACKENDS, DEFAULT_BACKEND
 
-def setup_enviornment():
-    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+WRITE_CHUNK = 512 #records embedded and upserted to chroma per round, batches are length sorted within a chunk
+SHARD_CHUNK = 64 #records a shard worker embeds before handing them to the writer
+METADATA_SCHEMA = 2 #bumped when write_chunk stores new metadata fields, it is part of every record's digest so older records get rewritten
+SYNC_PAGE = 4096 #ids and hashes read back from chroma per get when diffing in --sync mode
+PREPARE_THREADS = 4 #threads cleaning and tokenizing chunks ahead of the encoder
+PREFETCH_CHUNKS = 2 #chunks allowed to wait between two pipeline stages, keeps memory flat
 
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    model = AutoModel.from_pretrained(MODEL_NAME).to(device)
-    model.eval()
+def setup_enviornment(backend=DEFAULT_BACKEND):
+    return load_encoder(backend)
 
-    return tokenizer,model,device
+#discard non formal_property containing data and sanity checks, ensures that we dont process data that doesnt provide any info abt formal_prop
+def is_indexable(record):
+    return record.get('formal_property') is not None and record.get('metadata',{}).get('rule_name') != 'sanity'
 
-#fnc to discard non formal_property containing data and sanity checks and then return the data
+#the master index is streamed, records are filtered with is_indexable as they are read and fetched again by id when embedded
 def load_and_filter_data():
     try:
-        with open(PATH_TO_MASTER_INDEX,'r',encoding='utf-8') as f:
-            data = json.load(f)
-            filtered_data = [record for record in data if record.get('formal_property') is not None and record.get('metadata',{}).get('rule_name') != 'sanity'] #ensures that we dont process data that doesnt provide any info abt formal_prop
-            return filtered_data
+        return MasterIndex(PATH_TO_MASTER_INDEX)
     except FileNotFoundError:
         print("master_index file doesnt exist, run master_merger.py to create one")
         sys.exit(1)
-    except json.JSONDecodeError:
-        print("error decoding master_index.json")
+    except (json.JSONDecodeError, KeyError):
+        print("error decoding master_index.jsonl")
         sys.exit(1)
 
 #fnc to clean whitespaces, imports, license etc
@@ -45,48 +55,416 @@ def clean_code(code_chunk):
     code_chunk = re.sub(r'\s+', ' ', code_chunk).strip()
     return code_chunk
 
-def vectorization_pipeline(tokenizer,model,device,data):
-    client = chromadb.PersistentClient(path = PATH_TO_CHROMA_DB)
-    collection = client.get_or_create_collection(name="scria_knowledge_base")
-
-    for i in range(0,len(data),BATCH_SIZE):
-        batch = data[i:i+BATCH_SIZE]
-        texts_to_embed = [clean_code(temp_data['text_chunk']) for temp_data in batch]
-        inputs = tokenizer(
-            texts_to_embed, 
-            return_tensors="pt", 
-            padding=True, 
-            truncation=True 
-        ).to(device)
-
-        with torch.no_grad():
-            outputs = model(**inputs)
-            embeddings = outputs.last_hidden_state[:, 0, :].cpu().tolist()
-    
-        metadata_list = []
-        ids_list = []
-        for record in batch:
-            ids_list.append(record['id'])
-            metadata_list.append({
-                "source_contract": record['source_contract'],
-                "target_function": record['target_function'],
-                "formal_property": record['formal_property'],
-                "rule_type": record.get('metadata',{}).get('rule_type','RULE/INV')
-            })
-    
-    #ingesting data to our vector database
-        collection.add(
-            embeddings=embeddings,
-            documents=[f"Rule: {m['rule_type']} for {m['target_function']}" for m in metadata_list],
-            metadatas=metadata_list,
-            ids=ids_list
-        )
+#manifest section of a store, every store remembers what it holds on its own. chroma keeps the old section name
+def manifest_stage(store=None):
+    store = store or default_store()
+    return 'vectorizer' if store == "chroma" else f"vectorizer:{store}"
+
+#what a stored vector and its metadata were built from: the text_chunk and the metadata schema, so bumping the schema
+#makes the default path rewrite old records too, not just --sync
+def record_digest(record):
+    return sha256_text(f"{METADATA_SCHEMA}\0{record['text_chunk']}")
+
+#(record id, digest) of every indexable record whose text_chunk changed since the last run, and how many indexable records there are
+def find_pending(data, manifest, force=False, stage='vectorizer'):
+    pending = []
+    total = 0
+    for record in data.records(is_indexable):
+        total += 1
+        digest = record_digest(record)
+        if force or not manifest.is_fresh(stage, record['id'], digest):
+            pending.append((record['id'], digest))
+    return pending, total
+
+#(block hash, text hash, schema) stored with every vector, a record needs rewriting when either side of it or the stored fields changed
+def record_hashes(record, digest):
+    return record.get('metadata',{}).get('block_hash',''), digest, METADATA_SCHEMA
+
+#{id: (block hash, text hash)} of everything in the collection, read in pages of ids and metadata only, never the vectors
+def stored_hashes(collection):
+    stored = {}
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=SYNC_PAGE, offset=offset)
+        for record_id, metadata in zip(page['ids'], page['metadatas']):
+            metadata = metadata or {}
+            stored[record_id] = (metadata.get('block_hash',''), metadata.get('text_hash'), metadata.get('schema'))
+        if len(page['ids']) < SYNC_PAGE:
+            return stored
+        offset += SYNC_PAGE
+
+#sync mode diffs the master index against the collection itself instead of the manifest, so it also repairs a collection that was
+#wiped or written by another run. returns (pending [(id, digest)], indexable total, ids in chroma that are no longer in the master)
+def find_out_of_sync(data, collection):
+    stored = stored_hashes(collection)
+    pending = []
+    total = 0
+    for record in data.records(is_indexable):
+        total += 1
+        digest = record_digest(record)
+        if stored.pop(record['id'], None) != record_hashes(record, digest):
+            pending.append((record['id'], digest))
+    return pending, total, list(stored) #whatever is left was not matched by an indexable record
+
+#bulk delete of stale ids and their window vectors, in WRITE_CHUNK sized batches
+def prune(collection, windows_collection, stale_ids, manifest, stage='vectorizer'):
+    for i in range(0, len(stale_ids), WRITE_CHUNK):
+        batch = stale_ids[i:i+WRITE_CHUNK]
+        collection.delete(ids=batch)
+        windows_collection.delete(where={"parent_id": {"$in": batch}})
+        for record_id in batch:
+            manifest.forget(stage, record_id)
+    if stale_ids:
+        print(f"vectorizer: pruned {len(stale_ids)} records no longer in the master index")
+
+#pending records for this run, from the manifest or (sync) from diffing the collection, with stale ids deleted first in sync mode
+#(--force --sync prunes and then rewrites everything).
+#an empty store with a manifest behind it was wiped or never written, the manifest cant be trusted then so it is diffed like --sync
+def select_pending(data, manifest, collection, windows_collection, force=False, sync=False, stage='vectorizer'):
+    if not sync and manifest.section(stage) and collection.count() == 0:
+        print("vectorizer: the store is empty but the manifest is not, diffing against the store instead", file=sys.stderr)
+        sync = True
+    if not sync:
+        return find_pending(data, manifest, force, stage)
+    pending, total, stale_ids = find_out_of_sync(data, collection)
+    prune(collection, windows_collection, stale_ids, manifest, stage)
+    if force: #the diff only decided what to prune, every indexable record is rewritten
+        return find_pending(data, manifest, True, stage)
+    return pending, total
+
+#one chunk of embedded records into chroma, pooled vectors into the knowledge base and window vectors of long records into the windows collection
+def write_chunk(collection, windows_collection, records, embeddings, window_embeddings):
+    metadata_list = []
+    ids_list = []
+    for record in records:
+        ids_list.append(record['id'])
+        block_hash, text_hash, schema = record_hashes(record, record_digest(record))
+        record_metadata = record.get('metadata',{})
+        metadata_list.append({
+            "source_contract": record['source_contract'],
+            "target_function": record['target_function'],
+            "formal_property": record['formal_property'],
+            "rule_type": record_metadata.get('rule_type','RULE/INV'),
+            #filterable fields, rag_agent turns its filters into chroma where clauses on these
+            "chunk_type": record.get('chunk_type',''),
+            "modifies_state": bool(record_metadata.get('modifies_state', False)),
+            "project": record_metadata.get('project',''), #project root name, or the pair name for standalone pairs
+            "rule_name": record_metadata.get('rule_name',''),
+            "block_hash": block_hash, #both hashes let --sync diff the collection without the manifest
+            "text_hash": text_hash,
+            "schema": schema
+        })
+
+    #ingesting data to our vector database, upsert so changed records replace their old vectors
+    collection.upsert(
+        embeddings=embeddings,
+        documents=[f"Rule: {m['rule_type']} for {m['target_function']}" for m in metadata_list],
+        metadatas=metadata_list,
+        ids=ids_list
+    )
+
+    #multi vector entry of every long record, rag_agent max pools window hits per parent. old windows go first since a changed text can have fewer of them
+    windows_collection.delete(where={"parent_id": {"$in": ids_list}})
+    window_ids = []
+    window_vectors = []
+    window_metadata = []
+    for record_id, metadata, vectors in zip(ids_list, metadata_list, window_embeddings):
+        if len(vectors) < 2:
+            continue
+        for k, vector in enumerate(vectors):
+            window_ids.append(f"{record_id}::w{k}")
+            window_vectors.append(vector)
+            window_metadata.append({"parent_id": record_id, "window": k, "windows": len(vectors), "source_contract": metadata['source_contract'], "target_function": metadata['target_function']})
+    if window_ids:
+        windows_collection.upsert(embeddings=window_vectors, metadatas=window_metadata, ids=window_ids)
+
+#bm25 side of the knowledge base, rebuilt from the master index whenever the master changed. its ids are the collection's ids
+def refresh_lexical_index(data, force=False):
+    if not force and lexical_index.is_fresh(data.path):
+        return
+    count = lexical_index.build_lexical_index(data.records(), is_indexable, data.path)
+    print(f"lexical index: {count} records in {lexical_index.PATH_TO_LEXICAL_INDEX}")
+
+#seconds spent per pipeline stage, added to from several threads
+class StageTimer:
+    def __init__(self):
+        self.seconds = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def report(self, threads):
+        get = lambda stage: self.seconds.get(stage, 0.0)
+        print(f"stages: prepare {get('prepare'):.2f}s over {threads} threads, encode {get('encode'):.2f}s, write {get('write'):.2f}s "
+              f"(encoder waited {get('wait for input'):.2f}s for input and {get('wait for writer'):.2f}s on the writer)")
+
+#chroma writes on their own thread behind a bounded queue, the encoder only blocks when the writer is PREFETCH_CHUNKS behind
+class BackgroundWriter(threading.Thread):
+    def __init__(self, write, timer, maxsize=PREFETCH_CHUNKS):
+        super().__init__(daemon=True)
+        self.write = write
+        self.timer = timer
+        self.items = queue.Queue(maxsize=maxsize)
+        self.error = None
+
+    def run(self):
+        while True:
+            item = self.items.get()
+            if item is None:
+                return
+            if self.error is not None: #keep draining so submit never blocks on a dead writer
+                continue
+            started = time.perf_counter()
+            try:
+                self.write(*item)
+            except Exception as e:
+                self.error = e
+            self.timer.add('write', time.perf_counter() - started)
+
+    def submit(self, *item):
+        started = time.perf_counter()
+        if self.error is not None:
+            raise self.error
+        self.items.put(item)
+        self.timer.add('wait for writer', time.perf_counter() - started)
+
+    def close(self):
+        self.items.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+#bounded queue pipeline: a thread pool cleans and tokenizes chunks ahead of the encoder (at most PREFETCH_CHUNKS of them),
+#this thread runs the model and a background writer commits to chroma, every stage is timed to show which one limits throughput
+def vectorization_pipeline(tokenizer,model,device,data,force=False,tokens_per_batch=TOKENS_PER_BATCH,bucketed=True,prepare_threads=PREPARE_THREADS,sync=False,store=None):
+    collection = open_store(KNOWLEDGE_BASE, store, create=True)
+    windows_collection = open_store(WINDOWS_COLLECTION, store, create=True)
+
+    #only embed records whose text_chunk changed since the last run, just their ids are kept around
+    manifest = Manifest()
+    stage = manifest_stage(store)
+    pending, total = select_pending(data, manifest, collection, windows_collection, force, sync, stage)
+
+    throughput = Throughput()
+    cache = EmbeddingCache()
+    timer = StageTimer()
+    prepare_threads = min(prepare_threads, PREFETCH_CHUNKS) #no more than PREFETCH_CHUNKS chunks are ever in the pool, extra threads would sit idle
+
+    local = threading.local()
+    def prepare(chunk):
+        started = time.perf_counter()
+        if not hasattr(local, 'tokenizer'):
+            local.tokenizer = copy.deepcopy(tokenizer) #fast tokenizers are not safe to share between threads
+        records = [data.get(record_id) for record_id, _ in chunk]
+        texts_to_embed = [clean_code(record['text_chunk']) for record in records]
+        encodings = tokenize_windows(local.tokenizer, texts_to_embed)
+        timer.add('prepare', time.perf_counter() - started)
+        return chunk, records, texts_to_embed, encodings
+
+    def write(chunk, records, embeddings, window_embeddings):
+        write_chunk(collection, windows_collection, records, embeddings, window_embeddings)
+        for record_id, digest in chunk:
+            manifest.record(stage, record_id, digest)
+
+    chunks = [pending[i:i+WRITE_CHUNK] for i in range(0,len(pending),WRITE_CHUNK)]
+    writer = BackgroundWriter(write, timer)
+    writer.start()
+    try:
+        with ThreadPoolExecutor(max_workers=prepare_threads) as executor:
+            prepared = deque()
+            next_chunk = 0
+            while next_chunk < len(chunks) or prepared:
+                while next_chunk < len(chunks) and len(prepared) < PREFETCH_CHUNKS:
+                    prepared.append(executor.submit(prepare, chunks[next_chunk]))
+                    next_chunk += 1
+
+                started = time.perf_counter()
+                chunk, records, texts_to_embed, encodings = prepared.popleft().result()
+                timer.add('wait for input', time.perf_counter() - started)
+
+                started = time.perf_counter()
+                embeddings, window_embeddings = embed_texts(tokenizer, model, device, texts_to_embed, tokens_per_batch, bucketed, throughput, cache, encodings)
+                cache.put_many([cache_key(encoder_id(model), POOLING, text) for text in texts_to_embed], embeddings) #whole text lookups, rag_agent checks these before loading the model
+                timer.add('encode', time.perf_counter() - started)
+
+                writer.submit(chunk, records, embeddings, window_embeddings)
+    finally:
+        try:
+            writer.close() #everything handed to the writer is committed before the manifest is saved
+        finally:
+            collection.save() #the numpy store writes its files here, chroma already has everything
+            windows_collection.save()
+            manifest.save() #keep whatever got committed to chroma even if a batch fails
+            cache.save()
+    refresh_lexical_index(data, force)
+
+    report('vectorizer', len(pending), total-len(pending))
+    if pending:
+        throughput.report("vectorizer (bucketed)" if bucketed else "vectorizer (fixed batches)")
+        timer.report(prepare_threads)
+        print(cache.stats())
+    return throughput
+
+#sharded mode: worker processes each load the model with their own torch thread count and embed a disjoint slice of the pending records.
+#they never touch chroma, PersistentClient is not safe with concurrent writers, so their vectors go over a bounded queue to the parent which is the only writer
+#each worker opens the embedding cache itself (it locks across processes) and skips windows embedded by an earlier run, like the
+#single process pipeline. the scaling measurement runs without it so every shard count embeds the same work
+def shard_worker(shard, record_ids, threads, tokens_per_batch, bucketed, master_index_path, results, ready, backend=DEFAULT_BACKEND, use_cache=True):
+    try:
+        torch.set_num_threads(threads)
+        tokenizer, model, device = setup_enviornment(backend)
+        cache = EmbeddingCache() if use_cache else None
+        ready.wait() #every shard starts embedding at the same time, model loading is not part of the measured time
+        throughput = Throughput()
+        with MasterIndex(master_index_path) as data:
+            for i in range(0, len(record_ids), SHARD_CHUNK):
+                chunk_ids = record_ids[i:i+SHARD_CHUNK]
+                texts_to_embed = [clean_code(data.get(record_id)['text_chunk']) for record_id in chunk_ids]
+                embeddings, window_embeddings = embed_texts(tokenizer, model, device, texts_to_embed, tokens_per_batch, bucketed, throughput, cache)
+                keys = [cache_key(encoder_id(model), POOLING, text) for text in texts_to_embed]
+                results.put(("batch", shard, (chunk_ids, keys, embeddings, window_embeddings))) #blocks while the writer is behind
+        results.put(("done", shard, vars(throughput)))
+    except Exception:
+        ready.abort() #nobody waits forever on a shard that will never be ready
+        results.put(("error", shard, traceback.format_exc()))
+
+#start the shard workers over record_ids and feed every batch they send to handle(record_ids, cache_keys, embeddings, window_embeddings)
+#returns (wall seconds, combined throughput, errors). records are dealt out round robin so long and short texts spread evenly
+def run_shards(record_ids, shards, threads, handle=None, tokens_per_batch=TOKENS_PER_BATCH, bucketed=True, master_index_path=PATH_TO_MASTER_INDEX, backend=DEFAULT_BACKEND, use_cache=True):
+    context = multiprocessing.get_context("spawn") #torch does not survive fork
+    results = context.Queue(maxsize=2*shards)
+    ready = context.Barrier(shards+1)
+    processes = []
+    for shard in range(shards):
+        process = context.Process(target=shard_worker, args=(shard, record_ids[shard::shards], threads, tokens_per_batch, bucketed, master_index_path, results, ready, backend, use_cache))
+        process.start()
+        processes.append(process)
+
+    completed = False
+    try:
+        try:
+            ready.wait(timeout=600)
+        except threading.BrokenBarrierError:
+            pass #a shard failed to start, its error is on the queue
+        started = time.perf_counter()
+        throughput = Throughput()
+        errors = []
+        finished = set()
+        while len(finished) < shards:
+            try:
+                kind, shard, payload = results.get(timeout=5)
+            except queue.Empty:
+                for shard, process in enumerate(processes): #a worker killed before it could report
+                    if shard not in finished and not process.is_alive() and process.exitcode != 0:
+                        finished.add(shard)
+                        errors.append((shard, f"worker exited with code {process.exitcode}"))
+                continue
+            if kind == "batch":
+                if handle is not None:
+                    handle(*payload)
+            elif kind == "done":
+                finished.add(shard)
+                throughput.records += payload['records']
+                throughput.tokens += payload['tokens']
+                throughput.padded_tokens += payload['padded_tokens']
+            else:
+                finished.add(shard)
+                errors.append((shard, payload))
+        completed = True
+    finally:
+        for process in processes: #handle raised or we were interrupted: workers blocked on a full queue would never exit
+            if not completed and process.is_alive():
+                process.terminate()
+            process.join()
+        if not completed:
+            results.cancel_join_thread()
+        results.close()
+    throughput.seconds = time.perf_counter() - started #wall clock, the workers ran side by side
+    return throughput.seconds, throughput, errors
+
+def default_threads(shards):
+    return max(1, (os.cpu_count() or 1) // shards)
+
+def sharded_vectorization(data, shards, threads=None, force=False, tokens_per_batch=TOKENS_PER_BATCH, bucketed=True, backend=DEFAULT_BACKEND, sync=False, store=None):
+    collection = open_store(KNOWLEDGE_BASE, store, create=True)
+    windows_collection = open_store(WINDOWS_COLLECTION, store, create=True)
+
+    manifest = Manifest()
+    stage = manifest_stage(store)
+    pending, total = select_pending(data, manifest, collection, windows_collection, force, sync, stage)
+    digests = dict(pending)
+    cache = EmbeddingCache()
+
+    def handle(record_ids, keys, embeddings, window_embeddings):
+        write_chunk(collection, windows_collection, [data.get(record_id) for record_id in record_ids], embeddings, window_embeddings)
+        cache.put_many(keys, embeddings)
+        for record_id in record_ids:
+            manifest.record(stage, record_id, digests[record_id])
+
+    try:
+        _, throughput, errors = run_shards([record_id for record_id, _ in pending], shards, threads or default_threads(shards), handle, tokens_per_batch, bucketed, data.path, backend)
+    finally:
+        collection.save()
+        windows_collection.save()
+        manifest.save()
+        cache.save()
+    refresh_lexical_index(data, force)
+
+    report('vectorizer', len(pending), total-len(pending))
+    if pending:
+        throughput.report(f"vectorizer ({shards} shards x {threads or default_threads(shards)} threads)")
+    for shard, error in errors:
+        print(f"shard {shard} failed, its records stay pending for the next run:\n{error}", file=sys.stderr)
+    return throughput
+
+#embed the same sample with 1, 2, 4 .. max_shards workers (cores split evenly between them) without writing anything, and print the speedup
+def measure_scaling(data, max_shards, sample_size=256, tokens_per_batch=TOKENS_PER_BATCH, backend=DEFAULT_BACKEND):
+    sample = []
+    for record in data.records(is_indexable):
+        sample.append(record['id'])
+        if len(sample) >= sample_size:
+            break
+    shard_counts = sorted({2**k for k in range(max_shards.bit_length()) if 2**k <= max_shards} | {max_shards})
+
+    baseline = None
+    print(f"scaling over {len(sample)} records, {os.cpu_count()} cpus")
+    print("shards  threads  records/s  tokens/s  speedup  efficiency")
+    for shards in shard_counts:
+        seconds, throughput, errors = run_shards(sample, shards, default_threads(shards), None, tokens_per_batch, True, data.path, backend, use_cache=False)
+        if errors:
+            print(f"{shards} shards failed: {errors[0][1]}", file=sys.stderr)
+            continue
+        rate = throughput.records / max(seconds, 1e-9)
+        baseline = baseline or rate
+        print(f"{shards:>6}  {default_threads(shards):>7}  {rate:>9.1f}  {throughput.tokens/max(seconds, 1e-9):>8.0f}  {rate/baseline:>6.2f}x  {rate/baseline/shards:>9.0%}")
 
 if __name__ == "__main__":
     import torch
     import re
 
-    tokenizer,model,device = setup_enviornment()
-    data = load_and_filter_data()
-    vectorization_pipeline(tokenizer,model,device,data)
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="embed the master index into chroma")
+    arg_parser.add_argument("--force", action="store_true", help="re-embed every record even if the manifest (or with --sync, the collection) says it is unchanged")
+    arg_parser.add_argument("--sync", action="store_true", help="diff the master index against the collection, embed new or changed records and delete stale ones")
+    arg_parser.add_argument("--tokens-per-batch", type=int, default=TOKENS_PER_BATCH, help="padded token budget of one forward pass")
+    arg_parser.add_argument("--fixed-batches", action="store_true", help=f"old fixed batches of {BATCH_SIZE} in file order, to compare throughput")
+    arg_parser.add_argument("--shards", type=int, default=1, help="worker processes embedding disjoint slices (cpu hosts), this process stays the only chroma writer")
+    arg_parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads per shard, defaults to cpu count / shards")
+    arg_parser.add_argument("--scaling-report", action="store_true", help="measure throughput from 1 up to --shards workers on a sample, writes nothing")
+    arg_parser.add_argument("--scaling-sample", type=int, default=256)
+    arg_parser.add_argument("--store", choices=STORES, default=default_store(), help="chroma collection or the exact search numpy store (see vector_store.py)")
+    arg_parser.add_argument("--backend", choices=BACKENDS, default=DEFAULT_BACKEND, help="fp32 model, int8 dynamic quantization or onnxruntime (see encoder.py --parity)")
+    args = arg_parser.parse_args()
+
+    with load_and_filter_data() as data:
+        if args.scaling_report:
+            measure_scaling(data, max(args.shards, 1), args.scaling_sample, args.tokens_per_batch, args.backend)
+        elif args.shards > 1:
+            sharded_vectorization(data, args.shards, args.threads, force=args.force, tokens_per_batch=args.tokens_per_batch, bucketed=not args.fixed_batches, backend=args.backend, sync=args.sync, store=args.store)
+        else:
+            tokenizer,model,device = setup_enviornment(args.backend)
+            vectorization_pipeline(tokenizer,model,device,data,force=args.force,tokens_per_batch=args.tokens_per_batch,bucketed=not args.fixed_batches,sync=args.sync,store=args.store)
 